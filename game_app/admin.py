@@ -1,14 +1,75 @@
 from django.contrib import admin
+from django.core.exceptions import ValidationError
 from .models import (
-    Player, BoostType, Boost, PlayerBoostHistory,
-    PlayerTask2, Level, Award, PlayerLevel, LevelAward, PlayerAward
+    Player, BoostType, Boost, PlayerBoostHistory, DailyLoginStats, CohortRetention,
+    PlayerTask2, Level, Award, PlayerLevel, LevelAward, PlayerAward, GameJob
 )
+from .sharding import is_sharded, shard_aliases
+
+
+class ShardFilter(admin.SimpleListFilter):
+    #таблицы игроков читаются с одного выбранного шарда, без шардов фильтр скрыт
+    title = 'шард'
+    parameter_name = 'shard'
+    
+    def lookups(self, request, model_admin):
+        if not is_sharded():
+            return []
+        return [(alias, alias) for alias in shard_aliases()]
+    
+    def queryset(self, request, queryset):
+        if self.value() in shard_aliases():
+            return queryset.using(self.value())
+        return queryset
+    
+    def choices(self, changelist):
+        #пункта "Все" нет: запрос без using() роутер отправил бы на default
+        current = self.value() or shard_aliases()[0]
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == current,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    #админка таблиц игрока: список по шардам, объект ищется на всех шардах
+    show_full_result_count = False
+    
+    def get_list_filter(self, request):
+        return [ShardFilter, *super().get_list_filter(request)]
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(shard_aliases()[0])
+    
+    def get_readonly_fields(self, request, obj=None):
+        #игрок задает шард строки, перенос к другому игроку возможен только в пределах шарда
+        fields = list(super().get_readonly_fields(request, obj))
+        if obj is not None and is_sharded() and 'player' in {field.name for field in self.model._meta.fields}:
+            fields.append('player')
+        return fields
+    
+    def get_object(self, request, object_id, from_field=None):
+        #pk бустов и уровней игрока не кодирует шард
+        queryset = super().get_queryset(request)
+        field = self.model._meta.pk if from_field is None else self.model._meta.get_field(from_field)
+        try:
+            object_id = field.to_python(object_id)
+        except (ValidationError, ValueError):
+            return None
+        
+        for alias in shard_aliases():
+            obj = queryset.using(alias).filter(**{field.name: object_id}).first()
+            if obj is not None:
+                return obj
+        return None
 
 
 #Админ для первого задания
 
 @admin.register(Player)
-class PlayerAdmin(admin.ModelAdmin):
+class PlayerAdmin(ShardedModelAdmin):
     list_display = ['username', 'email', 'login_count', 'total_points', 'first_login', 'last_login']
     list_filter = ['created_at', 'first_login']
     search_fields = ['username', 'email']
@@ -22,7 +83,7 @@ class BoostTypeAdmin(admin.ModelAdmin):
 
 
 @admin.register(Boost)
-class BoostAdmin(admin.ModelAdmin):
+class BoostAdmin(ShardedModelAdmin):
     list_display = ['player', 'boost_type', 'quantity', 'source', 'level_earned', 'is_active', 'created_at']
     list_filter = ['boost_type', 'source', 'is_active', 'created_at']
     search_fields = ['player__username']
@@ -30,16 +91,28 @@ class BoostAdmin(admin.ModelAdmin):
 
 
 @admin.register(PlayerBoostHistory)
-class PlayerBoostHistoryAdmin(admin.ModelAdmin):
+class PlayerBoostHistoryAdmin(ShardedModelAdmin):
     list_display = ['player', 'boost_type', 'activated_at', 'expired_at', 'level_used']
     list_filter = ['boost_type', 'activated_at']
     search_fields = ['player__username']
 
 
+@admin.register(DailyLoginStats)
+class DailyLoginStatsAdmin(admin.ModelAdmin):
+    list_display = ['date', 'unique_players', 'logins', 'points']
+    ordering = ['-date']
+
+
+@admin.register(CohortRetention)
+class CohortRetentionAdmin(admin.ModelAdmin):
+    list_display = ['cohort_date', 'size', 'd1', 'd7', 'd30', 'computed_at']
+    ordering = ['-cohort_date']
+
+
 #Админ для воторого задания
 
 @admin.register(PlayerTask2)
-class PlayerTask2Admin(admin.ModelAdmin):
+class PlayerTask2Admin(ShardedModelAdmin):
     list_display = ['player_id']
     search_fields = ['player_id']
 
@@ -58,7 +131,7 @@ class AwardAdmin(admin.ModelAdmin):
 
 
 @admin.register(PlayerLevel)
-class PlayerLevelAdmin(admin.ModelAdmin):
+class PlayerLevelAdmin(ShardedModelAdmin):
     list_display = ['player', 'level', 'is_completed', 'completed', 'score']
     list_filter = ['is_completed', 'completed', 'level']
     search_fields = ['player__player_id', 'level__title']
@@ -71,8 +144,15 @@ class LevelAwardAdmin(admin.ModelAdmin):
 
 
 @admin.register(PlayerAward)
-class PlayerAwardAdmin(admin.ModelAdmin):
+class PlayerAwardAdmin(ShardedModelAdmin):
     list_display = ['player', 'award', 'level', 'received']
     list_filter = ['award', 'level', 'received']
     search_fields = ['player__player_id', 'award__title', 'level__title']
-    readonly_fields = ['received']
\ No newline at end of file
+    readonly_fields = ['received']
+
+
+@admin.register(GameJob)
+class GameJobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'status', 'attempts', 'group_key', 'run_after', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['created_at', 'claimed_at', 'finished_at']
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.db.models import Count, Max, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CohortRetention, DailyLoginStats, Player, day_start
+from .sharding import shard_aliases
+
+
+RETENTION_DAYS = (1, 7, 30)
+
+
+def compute_cohort(cohort_date):
+    #rolling retention: игрок удержан на день N, если заходил в день N или позже
+    counters = {'size': Count('id')}
+    for days in RETENTION_DAYS:
+        returned_from = day_start(cohort_date + timedelta(days=days))
+        counters[f'd{days}'] = Count('id', filter=Q(last_login__gte=returned_from))
+    
+    #один агрегатный запрос по индексу first_login на шард, суммы складываются
+    totals = dict.fromkeys(counters, 0)
+    for alias in shard_aliases():
+        values = Player.objects.using(alias).filter(
+            first_login__gte=day_start(cohort_date),
+            first_login__lt=day_start(cohort_date + timedelta(days=1)),
+        ).aggregate(**counters)
+        for name, value in values.items():
+            totals[name] += value
+    
+    return totals
+
+
+def changed_cohorts(since=None):
+    #когорты, в которых кто-то заходил после since; без since - все когорты
+    cohorts = set()
+    for alias in shard_aliases():
+        players = Player.objects.using(alias).filter(first_login__isnull=False)
+        if since is not None:
+            players = players.filter(last_login__gte=since)
+        
+        cohorts.update(
+            players.annotate(cohort=TruncDate('first_login'))
+            .values_list('cohort', flat=True)
+            .distinct()
+        )
+    
+    return sorted(cohorts)
+
+
+def refresh_retention(full=False):
+    #инкрементальный пересчет: удержание меняется только у когорт с новыми входами
+    watermark = None
+    if not full:
+        watermark = CohortRetention.objects.aggregate(value=Max('computed_at'))['value']
+    
+    #метка берется до чтения, входы во время пересчета попадут в следующий запуск
+    computed_at = timezone.now()
+    
+    rows = []
+    for cohort_date in changed_cohorts(since=watermark):
+        values = compute_cohort(cohort_date)
+        row, _ = CohortRetention.objects.update_or_create(
+            cohort_date=cohort_date,
+            defaults=dict(values, computed_at=computed_at),
+        )
+        rows.append(row)
+    
+    return rows
+
+
+def retention_matrix(start=None, end=None):
+    #матрица удержания из сводной таблицы; день N молодой когорты еще не наступил - None, а не 0
+    today = timezone.localdate()
+    rows = CohortRetention.objects.order_by('cohort_date')
+    if start is not None:
+        rows = rows.filter(cohort_date__gte=start)
+    if end is not None:
+        rows = rows.filter(cohort_date__lte=end)
+    
+    return [
+        {
+            'cohort': row.cohort_date,
+            'size': row.size,
+            **{
+                f'd{days}': None if row.cohort_date + timedelta(days=days) > today else row.rate(days)
+                for days in RETENTION_DAYS
+            },
+        }
+        for row in rows
+    ]
+
+
+def daily_active_counts(start, end):
+    #активные игроки по дням: закрытые дни из DailyLoginStats, текущий - по last_login
+    counts = dict(
+        DailyLoginStats.objects.filter(date__gte=start, date__lte=end)
+        .values_list('date', 'unique_players')
+    )
+    
+    today = timezone.localdate()
+    if start <= today <= end:
+        counts[today] = sum(
+            Player.objects.using(alias).filter(last_login__gte=day_start(today)).count()
+            for alias in shard_aliases()
+        )
+    
+    return counts
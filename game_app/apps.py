@@ -3,4 +3,25 @@ from django.apps import AppConfig
 
 class GameAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'game_app'
\ No newline at end of file
+    name = 'game_app'
+    
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save, pre_save
+        from . import sharding
+        from .catalog import level_catalog
+        from .models import Award, BoostType, Level, LevelAward, Player, PlayerTask2
+        from .resolver import player_resolver
+        
+        #справочник уровней сбрасывается при изменении уровней и наград
+        for model in (Level, Award, LevelAward):
+            post_save.connect(level_catalog.invalidate_on_commit, sender=model, dispatch_uid=f'catalog-save-{model.__name__}')
+            post_delete.connect(level_catalog.invalidate_on_commit, sender=model, dispatch_uid=f'catalog-delete-{model.__name__}')
+        post_delete.connect(player_resolver.invalidate_on_delete, sender=PlayerTask2, dispatch_uid='resolver-delete')
+        
+        #pk игрока кодирует его шард, справочники копируются на шарды при изменении;
+        #без шардов обработчики ничего не делают, GAME_SHARDS проверяется при вызове
+        for model in (Player, PlayerTask2):
+            pre_save.connect(sharding.assign_pk_on_save, sender=model, dispatch_uid=f'shard-pk-{model.__name__}')
+        for model in (BoostType, Level, Award, LevelAward):
+            post_save.connect(sharding.sync_catalog_on_change, sender=model, dispatch_uid=f'shard-sync-save-{model.__name__}')
+            post_delete.connect(sharding.sync_catalog_on_change, sender=model, dispatch_uid=f'shard-sync-delete-{model.__name__}')
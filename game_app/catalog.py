@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Level, LevelAward
+
+
+class LevelCatalog:
+    #статический список уровней с наградами в памяти процесса
+    #сигналы сбрасывают кэш только в своем процессе, в остальных он устаревает по TTL
+    
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._levels = None
+        self._loaded_at = 0.0
+        self._generation = 0
+    
+    def levels(self):
+        levels = self._levels
+        if levels is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return levels
+        
+        with self.lock:
+            if self._levels is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._levels
+            
+            #сброс во время загрузки: прочитанное могло устареть, в кэш не кладется
+            generation = self._generation
+            levels = self._load()
+            if generation == self._generation:
+                self._levels = levels
+                self._loaded_at = time.monotonic()
+            return levels
+    
+    def _load(self):
+        awards = defaultdict(list)
+        for level_id, award_id, title in LevelAward.objects.order_by('award_id').values_list(
+            'level_id', 'award_id', 'award__title'
+        ):
+            awards[level_id].append((award_id, title))
+        
+        return tuple(
+            {'id': level_id, 'title': title, 'order': order, 'awards': tuple(awards[level_id])}
+            for level_id, title, order in Level.objects.order_by('order', 'id').values_list('id', 'title', 'order')
+        )
+    
+    def invalidate(self, **kwargs):
+        self._generation += 1
+        self._levels = None
+    
+    def invalidate_on_commit(self, using=None, **kwargs):
+        #обработчик сигналов: до коммита перезагрузка прочитала бы старые данные
+        transaction.on_commit(self.invalidate, using=using)
+
+
+level_catalog = LevelCatalog()
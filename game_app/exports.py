@@ -0,0 +1,175 @@
+import csv
+import fcntl
+import gzip
+import hashlib
+import io
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+
+from .models import Award, GameService, Level, PlayerAward, PlayerLevel, PlayerTask2
+from .sharding import shard_aliases
+
+
+DEFAULTS = {
+    'OUTPUT_DIR': None,  #по умолчанию BASE_DIR / 'exports'
+    'MAX_AGE': 3600,  #секунды, после этого снимок пересобирается даже без изменений
+    'MAX_FILES': 5,
+    'MAX_BYTES': 512 * 1024 * 1024,
+    'FINGERPRINT_TTL': 10,  #секунды, версия данных не пересчитывается на каждый запрос
+    'HEADER': 'X-Game-Export-Token',
+    'TOKEN_MAX_AGE': 30 * 24 * 3600,
+}
+
+PREFIX = 'player_levels-'
+SUFFIX = '.csv.gz'
+SIGNING_SALT = 'game_app.exports'
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'GAME_EXPORTS', {})}
+    if config['OUTPUT_DIR'] is None:
+        config['OUTPUT_DIR'] = Path(settings.BASE_DIR) / 'exports'
+    config['OUTPUT_DIR'] = Path(config['OUTPUT_DIR'])
+    return config
+
+
+def data_fingerprint():
+    #версия данных выгрузки по агрегатам: число строк, последний id и число пройденных уровней на каждом шарде
+    parts = [
+        list(Level.objects.order_by('id').values_list('id', 'title')),
+        list(Award.objects.order_by('id').values_list('id', 'title')),
+    ]
+    for alias in shard_aliases():
+        parts.append(PlayerLevel.objects.using(alias).aggregate(
+            total=Count('id'), last=Max('id'), completed=Count('id', filter=Q(is_completed=True))
+        ))
+        parts.append(PlayerAward.objects.using(alias).aggregate(total=Count('id'), last=Max('id')))
+        parts.append(PlayerTask2.objects.using(alias).aggregate(total=Count('id'), last=Max('id')))
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def current_fingerprint():
+    #агрегаты по всем таблицам выгрузки считаются не чаще раза в FINGERPRINT_TTL
+    ttl = get_config()['FINGERPRINT_TTL']
+    fingerprint = cache.get('exports:fingerprint') if ttl else None
+    if fingerprint is None:
+        fingerprint = data_fingerprint()
+        if ttl:
+            cache.set('exports:fingerprint', fingerprint, ttl)
+    return fingerprint
+
+
+def make_token():
+    #подписанный токен внутреннего потребителя выгрузки
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign('exports')
+
+
+def is_valid_token(token):
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(token, max_age=get_config()['TOKEN_MAX_AGE'])
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class ExportSnapshots:
+    #gzip-снимки выгрузки на диске: один файл на версию данных, сборка под файловой блокировкой
+    
+    def path_for(self, fingerprint):
+        return get_config()['OUTPUT_DIR'] / f'{PREFIX}{fingerprint}{SUFFIX}'
+    
+    def open_fresh(self, path):
+        #открытый файл переживает удаление снимка evict() в другом процессе
+        try:
+            snapshot = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        if time.time() - os.fstat(snapshot.fileno()).st_mtime < get_config()['MAX_AGE']:
+            return snapshot
+        snapshot.close()
+        return None
+    
+    def open_snapshot(self, fingerprint=None):
+        #возвращает (fingerprint, открытый файл снимка); параллельные запросы ждут одну сборку
+        fingerprint = fingerprint or current_fingerprint()
+        path = self.path_for(fingerprint)
+        snapshot = self.open_fresh(path)
+        if snapshot is not None:
+            return fingerprint, snapshot
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.with_suffix('.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                #пока ждали блокировку, снимок мог собрать другой процесс
+                snapshot = self.open_fresh(path)
+                if snapshot is None:
+                    self.build(path)
+                    snapshot = open(path, 'rb')
+                    self.evict(keep=path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        
+        return fingerprint, snapshot
+    
+    def build(self, path):
+        #запись во временный файл и атомарная подмена: читатели не видят недописанный снимок
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            with gzip.open(tmp_path, 'wb') as raw:
+                with io.TextIOWrapper(raw, encoding='utf-8', newline='') as output:
+                    writer = csv.writer(output)
+                    writer.writerow(GameService.EXPORT_HEADER)
+                    writer.writerows(GameService.iter_player_level_rows())
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+    
+    def snapshots(self):
+        #от новых к старым
+        directory = get_config()['OUTPUT_DIR']
+        if not directory.exists():
+            return []
+        files = directory.glob(f'{PREFIX}*{SUFFIX}')
+        return sorted(files, key=lambda path: path.stat().st_mtime, reverse=True)
+    
+    def evict(self, keep=None):
+        #удаление по возрасту, числу файлов и суммарному размеру; текущий снимок не трогается
+        config = get_config()
+        now = time.time()
+        kept_files = 0
+        kept_bytes = 0
+        removed = []
+        
+        for path in self.snapshots():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            
+            if path != keep:
+                expired = now - stat.st_mtime >= config['MAX_AGE']
+                over_limit = (
+                    kept_files + 1 > config['MAX_FILES']
+                    or kept_bytes + stat.st_size > config['MAX_BYTES']
+                )
+                if expired or over_limit:
+                    path.unlink(missing_ok=True)
+                    path.with_suffix('.lock').unlink(missing_ok=True)
+                    removed.append(path)
+                    continue
+            
+            kept_files += 1
+            kept_bytes += stat.st_size
+        
+        return removed
+
+
+export_snapshots = ExportSnapshots()
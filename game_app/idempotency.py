@@ -0,0 +1,111 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyRecord
+
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 3600,
+    'MAX_DB_ENTRIES': 100000,
+}
+
+
+class IdempotencyCache:
+    #кэш ответов по ключу идемпотентности: кэш django, при промахе - таблица IdempotencyRecord
+    
+    def __init__(self):
+        self.counters = {'hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0, 'db_evictions': 0}
+    
+    @property
+    def config(self):
+        return {**DEFAULTS, **getattr(settings, 'GAME_IDEMPOTENCY', {})}
+    
+    @property
+    def cache(self):
+        return caches[self.config['CACHE_ALIAS']]
+    
+    def _digest(self, key):
+        #ключи клиента могут быть длинными и содержать любые символы
+        return hashlib.sha256(key.encode()).hexdigest()
+    
+    def _cache_key(self, key):
+        return 'idempotency:' + self._digest(key)
+    
+    def get(self, key):
+        response = self.cache.get(self._cache_key(key))
+        if response is not None:
+            self.counters['hits'] += 1
+            return response
+        
+        record = IdempotencyRecord.objects.filter(
+            key=self._digest(key), expires_at__gt=timezone.now()
+        ).values_list('response', flat=True).first()
+        if record is not None:
+            self.counters['db_hits'] += 1
+            self.remember(key, record)
+            return record
+        
+        self.counters['misses'] += 1
+        return None
+    
+    def remember(self, key, response):
+        #только кэш, без записи в базу
+        self.cache.set(self._cache_key(key), response, self.config['TTL'])
+    
+    def store(self, key, response):
+        #запись в базу; при гонке возвращается ответ, сохраненный первым
+        digest = self._digest(key)
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=self.config['TTL'])
+        try:
+            with transaction.atomic():
+                IdempotencyRecord.objects.create(key=digest, response=response, expires_at=expires_at)
+        except IntegrityError:
+            #истекшая строка еще не вытеснена purge: ключ снова свободен, строка перезаписывается
+            replaced = IdempotencyRecord.objects.filter(key=digest, expires_at__lte=now).update(
+                response=response, created_at=now, expires_at=expires_at
+            )
+            if not replaced:
+                return IdempotencyRecord.objects.get(key=digest).response
+        
+        self.counters['stores'] += 1
+        return response
+    
+    def purge(self):
+        #вытеснение из таблицы: сначала по TTL, затем самые старые сверх лимита;
+        #вызывается воркерами очереди, не из обработки запроса
+        evicted, _ = IdempotencyRecord.objects.filter(expires_at__lte=timezone.now()).delete()
+        
+        limit = self.config['MAX_DB_ENTRIES']
+        boundary = IdempotencyRecord.objects.order_by('-id').values_list('id', flat=True)[limit:limit + 1]
+        boundary = list(boundary)
+        if boundary:
+            overflow, _ = IdempotencyRecord.objects.filter(id__lte=boundary[0]).delete()
+            evicted += overflow
+        
+        self.counters['db_evictions'] += evicted
+        return evicted
+    
+    def stats(self):
+        config = self.config
+        cache_options = settings.CACHES.get(config['CACHE_ALIAS'], {}).get('OPTIONS', {})
+        lookups = self.counters['hits'] + self.counters['db_hits'] + self.counters['misses']
+        
+        return {
+            **self.counters,
+            'hit_rate': (self.counters['hits'] + self.counters['db_hits']) / lookups if lookups else 0.0,
+            'ttl': config['TTL'],
+            'cache_alias': config['CACHE_ALIAS'],
+            'cache_max_entries': cache_options.get('MAX_ENTRIES', 300),
+            'db_max_entries': config['MAX_DB_ENTRIES'],
+            'policy': 'cache: TTL + вытеснение бэкенда; база: TTL, затем самые старые сверх лимита',
+        }
+
+
+idempotency_cache = IdempotencyCache()
@@ -0,0 +1,219 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import date
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Level, LevelAward, Player, PlayerAward, PlayerLevel
+from .resolver import player_resolver
+from .sharding import group_by_shard, shard_for_key
+
+
+def iter_lines(path, offset=0):
+    #построчное чтение в бинарном режиме, чтобы знать байтовое смещение после каждой строки
+    with open(path, 'rb') as source:
+        source.seek(offset)
+        for line in source:
+            offset += len(line)
+            yield line, offset
+
+
+def parse_record(raw):
+    #проверка строки: внешний id игрока, id уровня и необязательная дата прохождения
+    player_id = str(raw['player_id']).strip()
+    if not player_id:
+        raise ValueError('пустой player_id')
+    
+    completed = raw.get('completed')
+    return {
+        'player_id': player_id,
+        'level_id': int(raw['level_id']),
+        'completed': date.fromisoformat(completed) if completed else None,
+    }
+
+
+def iter_records(path, fmt='jsonl', offset=0):
+    #генератор (запись или ошибка, смещение); многострочные поля csv не поддерживаются
+    header = None
+    if fmt == 'csv':
+        with open(path, 'rb') as source:
+            header_line = source.readline()
+        header = next(csv.reader([header_line.decode('utf-8-sig')]))
+        offset = max(offset, len(header_line))
+    
+    for line, end in iter_lines(path, offset):
+        if not line.strip():
+            continue
+        
+        #битая кодировка - такая же невалидная строка, как плохой json
+        try:
+            text = line.decode('utf-8').strip()
+            if fmt == 'csv':
+                raw = dict(zip(header, next(csv.reader([text]))))
+            else:
+                raw = json.loads(text)
+            yield parse_record(raw), end
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            yield ValueError(f"{e}: {line.decode('utf-8', 'replace').strip()[:200]}"), end
+
+
+def apply_chunk(records):
+    #пакетное разрешение id и bulk-вставки, одна транзакция на шард;
+    #возвращает число примененных пар и записи с неизвестным игроком или уровнем
+    levels = set(
+        Level.objects.filter(id__in={record['level_id'] for record in records})
+        .values_list('id', flat=True)
+    )
+    
+    awards = defaultdict(list)
+    for level_id, award_id in LevelAward.objects.filter(level_id__in=levels).values_list('level_id', 'award_id'):
+        awards[level_id].append(award_id)
+    
+    applied = 0
+    unresolved = []
+    for alias, shard_records in group_by_shard(records, key=lambda record: shard_for_key(record['player_id'])).items():
+        shard_applied, shard_unresolved = apply_shard_chunk(alias, shard_records, levels, awards)
+        applied += shard_applied
+        unresolved += shard_unresolved
+    return applied, unresolved
+
+
+def apply_shard_chunk(alias, records, levels, awards):
+    players = player_resolver.resolve_many(record['player_id'] for record in records)
+    
+    #для повторов пары берется самая ранняя дата прохождения
+    today = timezone.localdate()
+    completions = {}
+    unresolved = []
+    for record in records:
+        player_pk = players.get(record['player_id'])
+        if player_pk is None or record['level_id'] not in levels:
+            unresolved.append(record)
+            continue
+        pair = (player_pk, record['level_id'])
+        completed = record['completed'] or today
+        if pair not in completions or completed < completions[pair]:
+            completions[pair] = completed
+    
+    if not completions:
+        return 0, unresolved
+    
+    with transaction.atomic(using=alias):
+        existing = {
+            (player_pk, level_id): (pk, is_completed)
+            for pk, player_pk, level_id, is_completed in PlayerLevel.objects.using(alias).filter(
+                player_id__in={pair[0] for pair in completions},
+                level_id__in={pair[1] for pair in completions},
+            ).values_list('id', 'player_id', 'level_id', 'is_completed')
+        }
+        
+        PlayerLevel.objects.using(alias).bulk_create(
+            [
+                PlayerLevel(player_id=player_pk, level_id=level_id, is_completed=True, completed=completed)
+                for (player_pk, level_id), completed in completions.items()
+                if (player_pk, level_id) not in existing
+            ],
+            ignore_conflicts=True,
+        )
+        
+        #незавершенные записи обновляются одним UPDATE на дату
+        to_complete = defaultdict(list)
+        for pair, (pk, is_completed) in existing.items():
+            if pair in completions and not is_completed:
+                to_complete[completions[pair]].append(pk)
+        for completed, ids in to_complete.items():
+            PlayerLevel.objects.using(alias).filter(pk__in=ids).update(is_completed=True, completed=completed)
+        
+        PlayerAward.objects.using(alias).bulk_create(
+            [
+                PlayerAward(player_id=player_pk, level_id=level_id, award_id=award_id)
+                for player_pk, level_id in completions
+                for award_id in awards[level_id]
+            ],
+            ignore_conflicts=True,
+        )
+        
+        completed_players = {pair[0] for pair in completions}
+        Player.bump_revision(using=alias, username__in={
+            external_id for external_id, player_pk in players.items() if player_pk in completed_players
+        })
+    
+    return len(completions), unresolved
+
+
+class CompletionImporter:
+    #потоковый импорт прохождений с контрольной точкой по байтовому смещению
+    
+    def __init__(self, path, fmt=None, chunk_size=1000, checkpoint_path=None):
+        self.path = path
+        self.fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        self.chunk_size = chunk_size
+        self.checkpoint_path = checkpoint_path or f'{path}.checkpoint'
+        self.stats = {'rows': 0, 'invalid': 0, 'unresolved': 0, 'applied': 0, 'offset': 0, 'elapsed': 0.0}
+        self.errors = []
+    
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as source:
+                return json.load(source)['offset']
+        except FileNotFoundError:
+            return 0
+    
+    def save_checkpoint(self, offset):
+        temp_path = f'{self.checkpoint_path}.tmp'
+        with open(temp_path, 'w') as target:
+            json.dump({'offset': offset, 'rows': self.stats['rows']}, target)
+        os.replace(temp_path, self.checkpoint_path)
+    
+    def run(self, resume=False, progress=None):
+        offset = self.load_checkpoint() if resume else 0
+        self.stats['offset'] = offset
+        started = time.monotonic()
+        
+        chunk = []
+        for record, end in iter_records(self.path, self.fmt, offset):
+            self.stats['rows'] += 1
+            if isinstance(record, ValueError):
+                self.stats['invalid'] += 1
+                self._error(str(record))
+            else:
+                chunk.append(record)
+            
+            offset = end
+            if len(chunk) >= self.chunk_size:
+                self._commit(chunk, offset, started, progress)
+                chunk = []
+        
+        self._commit(chunk, offset, started, progress)
+        return self.stats
+    
+    def _commit(self, chunk, offset, started, progress):
+        if chunk:
+            applied, unresolved = apply_chunk(chunk)
+            self.stats['applied'] += applied
+            self.stats['unresolved'] += len(unresolved)
+            for record in unresolved:
+                self._error(f"неизвестный игрок или уровень: player_id={record['player_id']}, level_id={record['level_id']}")
+        
+        #смещение сохраняется только после коммита пачки
+        self.stats['offset'] = offset
+        self.stats['elapsed'] = time.monotonic() - started
+        self.save_checkpoint(offset)
+        
+        if progress is not None:
+            progress(self.stats)
+    
+    def _error(self, message):
+        #в памяти держатся только первые ошибки, счетчики в stats полные
+        if len(self.errors) < 100:
+            self.errors.append(message)
+    
+    @property
+    def rows_per_second(self):
+        if not self.stats['elapsed']:
+            return 0.0
+        return self.stats['rows'] / self.stats['elapsed']
@@ -0,0 +1,253 @@
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .idempotency import idempotency_cache
+from .models import Boost, BoostType, GameJob, GameService, Level, Player
+from .sharding import group_by_shard, shard_for_pk
+
+
+logger = logging.getLogger(__name__)
+
+def enqueue_level_completion(player_id, level_id, idempotency_key=None):
+    #прохождение уровня в очередь, группировка по уровню
+    return GameJob.objects.create(
+        kind='level_completion',
+        group_key=level_id,
+        payload={'player_id': player_id, 'level_id': level_id, 'idempotency_key': idempotency_key},
+    )
+
+
+def enqueue_boost_grant(player_id, boost_type_id, quantity=1, source='manual', level_number=None):
+    #начисление буста в очередь
+    return GameJob.objects.create(
+        kind='boost_grant',
+        payload={
+            'player_id': player_id,
+            'boost_type_id': boost_type_id,
+            'quantity': quantity,
+            'source': source,
+            'level_number': level_number,
+        },
+    )
+
+
+def grant_key(job):
+    #ключ начисления задания в Boost.campaign_id, акции этот префикс использовать не могут
+    return f'{Boost.JOB_CAMPAIGN_PREFIX}{job.pk}'
+
+
+def requeue_stale(timeout=timedelta(minutes=5), max_attempts=5):
+    #задания упавших воркеров возвращаются в очередь, исчерпавшие попытки считаются проваленными;
+    #сброс claim_token не дает прежнему воркеру перезаписать статус
+    now = timezone.now()
+    stale = GameJob.objects.filter(status='running', claimed_at__lt=now - timeout)
+    stale.filter(attempts__gte=max_attempts).update(
+        status='failed', claim_token='', finished_at=now, last_error='Воркер не завершил задание'
+    )
+    return stale.update(status='pending', claim_token='')
+
+
+def prune_finished(older_than=timedelta(days=1)):
+    #выполненные задания больше не нужны
+    deleted, _ = GameJob.objects.filter(
+        status='done', finished_at__lt=timezone.now() - older_than
+    ).delete()
+    return deleted
+
+
+def queue_stats():
+    #глубина очереди и задержки
+    now = timezone.now()
+    
+    depth = dict(
+        GameJob.objects.values_list('status').annotate(total=Count('id')).order_by()
+    )
+    pending = GameJob.objects.filter(status='pending').aggregate(
+        oldest=Min('created_at'), next_run=Min('run_after')
+    )
+    
+    #задержка выполнения по последним завершенным заданиям
+    recent = GameJob.objects.filter(
+        status='done', finished_at__gte=now - timedelta(hours=1)
+    ).values_list('created_at', 'finished_at')
+    latencies = sorted((finished - created).total_seconds() for created, finished in recent)
+    
+    return {
+        'depth': {status: depth.get(status, 0) for status, _ in GameJob.JOB_STATUSES},
+        'oldest_pending_age': (now - pending['oldest']).total_seconds() if pending['oldest'] else 0.0,
+        'done_last_hour': len(latencies),
+        'latency_avg': sum(latencies) / len(latencies) if latencies else 0.0,
+        'latency_p95': latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+    }
+
+
+class JobWorker:
+    #воркер очереди: забирает пачку заданий и выполняет их, группируя по уровню
+    
+    def __init__(self, worker_id=None, batch_size=50, max_attempts=5, backoff_seconds=2.0):
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+    
+    def claim(self):
+        now = timezone.now()
+        token = f'{self.worker_id}:{uuid.uuid4().hex}'[:64]
+        ready = GameJob.objects.filter(status='pending', run_after__lte=now).order_by('run_after', 'id')
+        claim = dict(status='running', claim_token=token, claimed_at=now, attempts=F('attempts') + 1)
+        
+        if connection.features.has_select_for_update_skip_locked:
+            #занятые другими воркерами строки пропускаются
+            with transaction.atomic():
+                ids = list(ready.select_for_update(skip_locked=True).values_list('id', flat=True)[:self.batch_size])
+                GameJob.objects.filter(pk__in=ids).update(**claim)
+        else:
+            #без SKIP LOCKED задание достается тому, чей UPDATE по статусу прошел первым
+            ids = list(ready.values_list('id', flat=True)[:self.batch_size])
+            GameJob.objects.filter(pk__in=ids, status='pending').update(**claim)
+        
+        return list(GameJob.objects.filter(claim_token=token, status='running'))
+    
+    def run_once(self):
+        jobs = self.claim()
+        if not jobs:
+            return 0
+        
+        failures = {}
+        by_kind = defaultdict(list)
+        for job in jobs:
+            by_kind[job.kind].append(job)
+        
+        failures.update(self._run_level_completions(by_kind['level_completion']))
+        failures.update(self._run_boost_grants(by_kind['boost_grant']))
+        
+        self._finish(jobs, failures)
+        return len(jobs)
+    
+    def run(self, poll_interval=1.0, should_stop=lambda: False, max_backoff=30.0):
+        last_requeue = 0.0
+        backoff = poll_interval
+        while not should_stop():
+            try:
+                #раз в минуту: зависшие задания и вытеснение ключей идемпотентности
+                if time.monotonic() - last_requeue > 60:
+                    requeue_stale(max_attempts=self.max_attempts)
+                    idempotency_cache.purge()
+                    last_requeue = time.monotonic()
+                
+                processed = self.run_once()
+            except Exception:
+                #занятая база и прочие сбои не останавливают воркер: пауза растет до max_backoff
+                logger.exception('Ошибка воркера %s, повтор через %.1f с', self.worker_id, backoff)
+                time.sleep(backoff)
+                backoff = min(max(backoff, 0.1) * 2, max_backoff)
+                continue
+            
+            backoff = poll_interval
+            #при полной пачке очередь не пуста, спать не нужно
+            if processed < self.batch_size:
+                time.sleep(poll_interval)
+    
+    def _run_level_completions(self, jobs):
+        failures = {}
+        by_level = defaultdict(list)
+        for job in jobs:
+            by_level[job.payload['level_id']].append(job)
+        
+        for level_id, level_jobs in by_level.items():
+            #уровень и награды читаются один раз на группу
+            try:
+                context = GameService.load_level_context(level_id)
+            except Level.DoesNotExist:
+                context = None
+            
+            for job in level_jobs:
+                if context is None:
+                    failures[job.pk] = 'Уровень не найден'
+                    continue
+                
+                result = GameService.assign_award_for_level_completion(
+                    job.payload['player_id'],
+                    level_id,
+                    idempotency_key=job.payload.get('idempotency_key') or f'job:{job.pk}',
+                    level_context=context,
+                )
+                if not result['success']:
+                    failures[job.pk] = result['error']
+        
+        return failures
+    
+    def _run_boost_grants(self, jobs):
+        if not jobs:
+            return {}
+        
+        failures = {}
+        boost_types = BoostType.objects.in_bulk({job.payload['boost_type_id'] for job in jobs})
+        
+        #начисления одного шарда вставляются одним bulk_create
+        by_shard = group_by_shard(jobs, key=lambda job: shard_for_pk(job.payload['player_id']))
+        for alias, shard_jobs in by_shard.items():
+            players = Player.objects.using(alias).in_bulk({job.payload['player_id'] for job in shard_jobs})
+            
+            #ключ начисления job:<pk>: повторный запуск задания не дублирует буст
+            granted = set(Boost.objects.using(alias).filter(
+                campaign_id__in=[grant_key(job) for job in shard_jobs]
+            ).values_list('campaign_id', flat=True))
+            
+            boosts = []
+            for job in shard_jobs:
+                payload = job.payload
+                if payload['player_id'] not in players:
+                    failures[job.pk] = 'Игрок не найден'
+                elif payload['boost_type_id'] not in boost_types:
+                    failures[job.pk] = 'Тип буста не найден'
+                elif grant_key(job) not in granted:
+                    boosts.append(Boost(
+                        player_id=payload['player_id'],
+                        boost_type_id=payload['boost_type_id'],
+                        quantity=payload['quantity'],
+                        source=payload['source'],
+                        level_earned=payload['level_number'],
+                        campaign_id=grant_key(job),
+                    ))
+            
+            try:
+                with transaction.atomic(using=alias):
+                    #параллельный владелец того же задания мог вставить строку между проверкой и вставкой
+                    Boost.objects.using(alias).bulk_create(boosts, ignore_conflicts=True)
+                    Player.bump_revision(using=alias, pk__in={boost.player_id for boost in boosts})
+            except Exception as e:
+                granted = {job.pk for job in shard_jobs} - set(failures)
+                failures.update({pk: str(e) for pk in granted})
+        
+        return failures
+    
+    def _finish(self, jobs, failures):
+        #только пока задание за этим воркером: после requeue_stale у него новый владелец
+        now = timezone.now()
+        owned = GameJob.objects.filter(claim_token=jobs[0].claim_token)
+        
+        done = [job.pk for job in jobs if job.pk not in failures]
+        owned.filter(pk__in=done).update(status='done', finished_at=now, last_error='')
+        
+        #повтор с экспоненциальной задержкой, после max_attempts задание считается проваленным
+        for job in jobs:
+            if job.pk not in failures:
+                continue
+            
+            if job.attempts >= self.max_attempts:
+                update = dict(status='failed', finished_at=now)
+            else:
+                delay = self.backoff_seconds * 2 ** (job.attempts - 1)
+                update = dict(status='pending', run_after=now + timedelta(seconds=delay))
+            
+            owned.filter(pk=job.pk).update(claim_token='', last_error=failures[job.pk], **update)
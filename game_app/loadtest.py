@@ -0,0 +1,280 @@
+import random
+import time
+from collections import defaultdict
+from urllib import request as urlrequest
+from urllib.error import HTTPError
+
+from django.db import OperationalError
+from django.test import Client
+
+from .exports import get_config as get_export_config, make_token as make_export_token
+from .models import Award, Boost, BoostType, GameService, Level, LevelAward, Player, PlayerTask2
+from .sharding import assign_pks, group_by_shard, shard_aliases, shard_for_key, shard_for_pk
+
+
+PREFIX = 'load-'  #префикс тестовых игроков, уровней и типа буста нагрузочного прогона
+
+#операции и их веса по умолчанию
+DEFAULT_MIX = {
+    'login': 40,
+    'award_boost': 15,
+    'activate_boost': 15,
+    'complete_level': 20,
+    'state': 8,
+    'export': 2,
+}
+
+LOCK_MARKERS = ('locked', 'lock timeout', 'lock wait timeout', 'deadlock')
+
+
+def parse_mix(text):
+    #"login=50,export=1" -> веса операций, неуказанные операции не выполняются
+    if not text:
+        return dict(DEFAULT_MIX)
+    
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'Неизвестная операция: {name}')
+        mix[name] = float(weight or 1)
+    
+    if sum(mix.values()) <= 0:
+        raise ValueError('Сумма весов должна быть больше нуля')
+    return mix
+
+
+def is_lock_error(exc):
+    message = str(exc).lower()
+    return any(marker in message for marker in LOCK_MARKERS)
+
+
+def percentile(values, fraction):
+    #values уже отсортированы
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def prepare_fixtures(players, levels=5):
+    #игроки load-N и уровни создаются один раз и переиспользуются между прогонами
+    #свой тип буста: настоящие типы не создаются и не меняются
+    boost_type, _ = BoostType.objects.get_or_create(
+        name=f'{PREFIX}boost', defaults={'duration_minutes': 1, 'description': 'нагрузочный прогон'}
+    )
+    award, _ = Award.objects.get_or_create(title=f'{PREFIX}award')
+    level_ids = []
+    for order in range(1, levels + 1):
+        level, _ = Level.objects.get_or_create(title=f'{PREFIX}level-{order}', defaults={'order': order})
+        LevelAward.objects.get_or_create(level=level, award=award)
+        level_ids.append(level.id)
+    
+    names = [f'{PREFIX}{index}' for index in range(players)]
+    player_ids = {}
+    task_ids = {}
+    
+    for alias, group in group_by_shard(names, key=shard_for_key).items():
+        existing = dict(Player.objects.using(alias).filter(username__in=group).values_list('username', 'id'))
+        missing = [
+            Player(username=name, email=f'{name}@load.test')
+            for name in group if name not in existing
+        ]
+        for player in Player.objects.using(alias).bulk_create(assign_pks(missing)):
+            existing[player.username] = player.pk
+        player_ids.update(existing)
+        
+        tasks = dict(PlayerTask2.objects.using(alias).filter(player_id__in=group).values_list('player_id', 'id'))
+        missing = [PlayerTask2(player_id=name) for name in group if name not in tasks]
+        for task in PlayerTask2.objects.using(alias).bulk_create(assign_pks(missing)):
+            tasks[task.player_id] = task.pk
+        task_ids.update(tasks)
+    
+    return {
+        'players': [(player_ids[name], task_ids[name]) for name in names],
+        'boost_type': boost_type.id,
+        'levels': level_ids,
+    }
+
+
+def cleanup_fixtures():
+    #удаление всего, что создал прогон
+    deleted = 0
+    for alias in shard_aliases():
+        deleted += Player.objects.using(alias).filter(username__startswith=PREFIX).delete()[0]
+        deleted += PlayerTask2.objects.using(alias).filter(player_id__startswith=PREFIX).delete()[0]
+    deleted += Level.objects.filter(title__startswith=PREFIX).delete()[0]
+    deleted += Award.objects.filter(title__startswith=PREFIX).delete()[0]
+    deleted += BoostType.objects.filter(name__startswith=PREFIX).delete()[0]
+    return deleted
+
+
+class Simulation:
+    #один процесс нагрузки: случайные игроки, операции по весам, замеры по интервалам
+    
+    def __init__(self, fixtures, mix, seed=0, base_url=None, think_time=0.0):
+        self.fixtures = fixtures
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.rng = random.Random(seed)
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.think_time = think_time
+        self.client = Client(HTTP_HOST='localhost')
+        self.boost_type = BoostType.objects.get(pk=fixtures['boost_type'])
+    
+    def run(self, duration, interval=5.0, started=None):
+        started = started or time.time()
+        deadline = started + duration
+        buckets = defaultdict(lambda: defaultdict(lambda: {'latencies': [], 'errors': 0, 'lock_timeouts': 0, 'samples': []}))
+        
+        while True:
+            now = time.time()
+            if now >= deadline:
+                break
+            
+            name = self.rng.choices(self.names, self.weights)[0]
+            player_id, task_id = self.rng.choice(self.fixtures['players'])
+            
+            begin = time.perf_counter()
+            error = None
+            try:
+                getattr(self, f'op_{name}')(player_id, task_id)
+            except Exception as exc:
+                error = exc
+            elapsed = time.perf_counter() - begin
+            
+            stats = buckets[int((now - started) // interval)][name]
+            if error is None:
+                stats['latencies'].append(elapsed)
+            elif isinstance(error, OperationalError) and is_lock_error(error):
+                stats['lock_timeouts'] += 1
+            else:
+                stats['errors'] += 1
+                if len(stats['samples']) < 3:
+                    stats['samples'].append(f'{type(error).__name__}: {error}')
+            
+            if self.think_time:
+                time.sleep(self.think_time)
+        
+        #обычные dict для передачи между процессами; последняя операция может выйти за дедлайн
+        return {
+            'elapsed': time.time() - started,
+            'buckets': {bucket: dict(ops) for bucket, ops in buckets.items()},
+        }
+    
+    def load_player(self, player_id):
+        return Player.objects.using(shard_for_pk(player_id)).get(pk=player_id)
+    
+    def op_login(self, player_id, task_id):
+        self.load_player(player_id).record_login()
+    
+    def op_award_boost(self, player_id, task_id):
+        Boost.award_boost_manually(self.load_player(player_id), self.boost_type)
+    
+    def op_activate_boost(self, player_id, task_id):
+        boost = Boost.objects.using(shard_for_pk(player_id)).select_related('boost_type').filter(
+            player_id=player_id, is_active=False, quantity__gt=0
+        ).first()
+        if boost is None:
+            boost = Boost.award_boost_manually(self.load_player(player_id), self.boost_type)
+        boost.activate()
+    
+    def op_complete_level(self, player_id, task_id):
+        level_id = self.rng.choice(self.fixtures['levels'])
+        GameService.submit_score(task_id, level_id, self.rng.randint(1, 1000))
+        GameService.assign_award_for_level_completion(task_id, level_id)
+    
+    def get(self, path, headers=None):
+        #тестовый клиент Django или живой сервер по --base-url, тело читается целиком
+        headers = headers or {}
+        if self.base_url is None:
+            response = self.client.get(path, headers=headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            response.close()
+            status = response.status_code
+        else:
+            try:
+                with urlrequest.urlopen(urlrequest.Request(self.base_url + path, headers=headers), timeout=30) as response:
+                    response.read()
+                    status = response.status
+            except HTTPError as exc:
+                status = exc.code
+        if status >= 400:
+            raise RuntimeError(f'HTTP {status}')
+    
+    def internal_headers(self):
+        #токен подписан SECRET_KEY, для --base-url сервер должен работать с теми же настройками
+        return {get_export_config()['HEADER']: make_export_token()}
+    
+    def op_state(self, player_id, task_id):
+        self.get(f'/players/{player_id}/state/', headers=self.internal_headers())
+    
+    def op_export(self, player_id, task_id):
+        self.get('/exports/player-levels.csv.gz', headers=self.internal_headers())
+
+
+OPERATIONS = [name[3:] for name in dir(Simulation) if name.startswith('op_')]
+
+
+def summarize_stats(latencies, errors, lock_timeouts, seconds):
+    latencies.sort()
+    total = len(latencies) + errors + lock_timeouts
+    return {
+        'operations': total,
+        'throughput': round(total / seconds, 2) if seconds else 0.0,
+        'errors': errors,
+        'lock_timeouts': lock_timeouts,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'lock_timeout_rate': round(lock_timeouts / total, 4) if total else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def summarize(results, interval):
+    #слияние замеров всех процессов: итог, по операциям и по интервалам времени
+    per_bucket = defaultdict(lambda: defaultdict(lambda: [[], 0, 0]))
+    samples = defaultdict(list)
+    duration = max((result['elapsed'] for result in results), default=0.0)
+    
+    for result in results:
+        for bucket, ops in result['buckets'].items():
+            for name, stats in ops.items():
+                merged = per_bucket[bucket][name]
+                merged[0].extend(stats['latencies'])
+                merged[1] += stats['errors']
+                merged[2] += stats['lock_timeouts']
+                samples[name].extend(stats['samples'])
+    
+    by_operation = defaultdict(lambda: [[], 0, 0])
+    timeline = []
+    for bucket in sorted(per_bucket):
+        bucket_totals = [[], 0, 0]
+        for name, (latencies, errors, lock_timeouts) in per_bucket[bucket].items():
+            for target in (by_operation[name], bucket_totals):
+                target[0].extend(latencies)
+                target[1] += errors
+                target[2] += lock_timeouts
+        
+        seconds = min(interval, duration - bucket * interval)
+        timeline.append({'start_s': bucket * interval, **summarize_stats(*bucket_totals, seconds)})
+    
+    totals = [[], 0, 0]
+    operations = {}
+    for name, (latencies, errors, lock_timeouts) in sorted(by_operation.items()):
+        totals[0].extend(latencies)
+        totals[1] += errors
+        totals[2] += lock_timeouts
+        operations[name] = summarize_stats(latencies, errors, lock_timeouts, duration)
+        if samples[name]:
+            operations[name]['error_samples'] = samples[name][:3]
+    
+    return {
+        'elapsed': round(duration, 3),
+        'totals': summarize_stats(*totals, duration),
+        'operations': operations,
+        'timeline': timeline,
+    }
@@ -0,0 +1,35 @@
+from datetime import date
+
+from django.core.management.base import CommandError
+
+from game_app import analytics
+from game_app.profiling import ProfiledCommand
+
+
+class Command(ProfiledCommand):
+    help = 'Пересчитывает удержание когорт (D1/D7/D30) и выводит матрицу'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='пересчитать все когорты')
+        parser.add_argument('--since', help='выводить когорты начиная с YYYY-MM-DD')
+    
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Неверная дата: {options['since']}")
+        
+        updated = analytics.refresh_retention(full=options['full'])
+        self.stdout.write(f"Пересчитано когорт: {len(updated)}")
+        
+        header = ['cohort', 'size'] + [f'd{days}' for days in analytics.RETENTION_DAYS]
+        self.stdout.write('\t'.join(header))
+        
+        for row in analytics.retention_matrix(start=since):
+            rates = [
+                '-' if row[f'd{days}'] is None else f"{row[f'd{days}']:.1%}"
+                for days in analytics.RETENTION_DAYS
+            ]
+            self.stdout.write('\t'.join([str(row['cohort']), str(row['size'])] + rates))
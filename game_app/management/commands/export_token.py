@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from game_app.exports import get_config, make_token
+
+
+class Command(BaseCommand):
+    help = 'Выдает подписанный токен для GET /exports/player-levels.csv.gz'
+    
+    def handle(self, *args, **options):
+        config = get_config()
+        token = make_token()
+        
+        self.stdout.write(token)
+        self.stdout.write(f"Заголовок: {config['HEADER']}: {token}, действует {config['TOKEN_MAX_AGE']} с")
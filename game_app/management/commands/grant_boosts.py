@@ -0,0 +1,86 @@
+from datetime import date, timedelta
+
+from django.core.exceptions import FieldError, ValidationError
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from game_app.models import Boost, BoostType, Player, day_start
+from game_app.profiling import ProfiledCommand
+from game_app.sharding import shard_aliases
+
+
+class Command(ProfiledCommand):
+    help = 'Выдает буст всем игрокам по фильтру пачками INSERT ... SELECT; повтор с тем же --campaign ничего не дублирует'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--campaign', required=True, help='id акции, один буст на игрока')
+        parser.add_argument('--boost-type', required=True, choices=[name for name, _ in BoostType.BOOST_TYPES])
+        parser.add_argument('--quantity', type=int, default=1)
+        parser.add_argument('--source', default='campaign', choices=[name for name, _ in Boost.BOOST_SOURCES])
+        activity = parser.add_mutually_exclusive_group()
+        activity.add_argument('--active-days', type=int, help='заходили за последние N дней')
+        activity.add_argument('--since', help='заходили начиная с YYYY-MM-DD')
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='LOOKUP=VALUE',
+            help='дополнительный фильтр Player, например total_points__gte=100',
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='только посчитать игроков')
+    
+    def handle(self, *args, **options):
+        if options['quantity'] < 1:
+            raise CommandError('--quantity должен быть не меньше 1')
+        if options['campaign'].startswith(Boost.JOB_CAMPAIGN_PREFIX):
+            raise CommandError(f'Префикс {Boost.JOB_CAMPAIGN_PREFIX} в --campaign зарезервирован за очередью заданий')
+        
+        try:
+            boost_type = BoostType.objects.get(name=options['boost_type'])
+        except BoostType.DoesNotExist:
+            raise CommandError(f"Тип буста {options['boost_type']} не создан")
+        
+        players = self.build_filter(options)
+        
+        if options['dry_run']:
+            matched = already = 0
+            for alias in shard_aliases():
+                matched += players.using(alias).values('id').distinct().count()
+                already += players.using(alias).filter(boosts__campaign_id=options['campaign']).values('id').distinct().count()
+            self.stdout.write(f"Подходит игроков: {matched}, уже получили: {already}")
+            return
+        
+        granted = Boost.grant_campaign_boosts(
+            options['campaign'],
+            players,
+            boost_type,
+            quantity=options['quantity'],
+            source=options['source'],
+            chunk_size=options['chunk_size'],
+            progress=self.write_progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Выдано бустов: {granted}"))
+    
+    def build_filter(self, options):
+        lookups = {}
+        if options['active_days']:
+            lookups['last_login__gte'] = timezone.now() - timedelta(days=options['active_days'])
+        if options['since']:
+            try:
+                lookups['last_login__gte'] = day_start(date.fromisoformat(options['since']))
+            except ValueError:
+                raise CommandError(f"Неверная дата: {options['since']}")
+        
+        for item in options['filter']:
+            lookup, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'Фильтр без значения: {item}')
+            lookups[lookup] = value
+        
+        try:
+            players = Player.objects.filter(**lookups)
+            str(players.query)
+        except (FieldError, ValidationError, ValueError) as exc:
+            raise CommandError(f'Неверный фильтр: {exc}')
+        return players
+    
+    def write_progress(self, alias, last_id, granted):
+        self.stdout.write(f"[{alias}] до id {last_id}: выдано {granted}")
@@ -0,0 +1,44 @@
+from django.core.management.base import CommandError
+
+from game_app.importer import CompletionImporter
+from game_app.profiling import ProfiledCommand
+
+
+class Command(ProfiledCommand):
+    help = 'Потоковый импорт прохождений уровней из JSONL/CSV'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл с полями player_id, level_id, completed')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='по умолчанию по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--resume', action='store_true', help='продолжить с контрольной точки')
+        parser.add_argument('--checkpoint', help='файл контрольной точки, по умолчанию <path>.checkpoint')
+    
+    def handle(self, *args, **options):
+        importer = CompletionImporter(
+            options['path'],
+            fmt=options['format'],
+            chunk_size=options['chunk_size'],
+            checkpoint_path=options['checkpoint'],
+        )
+        
+        def progress(stats):
+            self.stdout.write(
+                f"строк {stats['rows']}, применено {stats['applied']}, ошибок {stats['invalid']}, "
+                f"не найдено {stats['unresolved']}, "
+                f"смещение {stats['offset']}, {importer.rows_per_second:.0f} строк/с"
+            )
+        
+        try:
+            stats = importer.run(resume=options['resume'], progress=progress)
+        except FileNotFoundError:
+            raise CommandError(f"Файл не найден: {options['path']}")
+        
+        for error in importer.errors[:10]:
+            self.stderr.write(f"Пропущена строка: {error}")
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: {stats['rows']} строк за {stats['elapsed']:.1f} с "
+            f"({importer.rows_per_second:.0f} строк/с), ошибок {stats['invalid']}, "
+            f"не найдено игроков или уровней {stats['unresolved']}"
+        ))
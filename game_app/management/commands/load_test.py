@@ -0,0 +1,167 @@
+import json
+import multiprocessing
+import platform
+import queue as queue_module
+import time
+
+import django
+from django.core.management.base import CommandError
+from django.db import connections
+from django.utils import timezone
+
+from game_app import loadtest
+from game_app.profiling import ProfiledCommand
+
+
+def worker_main(index, fixtures, mix, options, started, queue):
+    #после fork у процесса свои соединения с базой; результат отправляется при любом исходе
+    connections.close_all()
+    try:
+        simulation = loadtest.Simulation(
+            fixtures, mix,
+            seed=options['seed'] + index,
+            base_url=options['base_url'],
+            think_time=options['think_time'] / 1000,
+        )
+        result = simulation.run(options['duration'], options['interval'], started)
+    except KeyboardInterrupt:
+        result = {'elapsed': time.time() - started, 'buckets': {}}
+    except Exception as exc:
+        result = {'elapsed': time.time() - started, 'buckets': {}, 'error': f'{type(exc).__name__}: {exc}'}
+    queue.put({'worker': index, **result})
+
+
+class Command(ProfiledCommand):
+    help = (
+        'Нагрузочный прогон: N процессов выполняют смесь операций игроков load-* '
+        'и пишут пропускную способность, перцентили задержек и долю ошибок в JSON. '
+        'Пишет в настроенную базу'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=30.0, help='секунды')
+        parser.add_argument('--interval', type=float, default=5.0, help='шаг временного ряда, секунды')
+        parser.add_argument('--players', type=int, default=200)
+        parser.add_argument('--mix', default='', help='веса операций, например login=50,state=30,export=1')
+        parser.add_argument('--think-time', type=float, default=0.0, help='пауза между операциями, мс')
+        parser.add_argument('--base-url', help='сервер для операции state, иначе тестовый клиент Django')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--label', default='', help='метка прогона, например версия релиза')
+        parser.add_argument('--output', default='loadtest_results.json')
+        parser.add_argument('--grace', type=float, default=120.0, help='ожидание результатов после --duration, секунды')
+        parser.add_argument('--cleanup', action='store_true', help='удалить данные load-* и выйти')
+    
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            self.stdout.write(f"Удалено строк: {loadtest.cleanup_fixtures()}")
+            return
+        
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        
+        fixtures = loadtest.prepare_fixtures(options['players'])
+        
+        #соединения родителя не должны наследоваться дочерними процессами
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        started = time.time()
+        processes = [
+            context.Process(target=worker_main, args=(index, fixtures, mix, options, started, queue))
+            for index in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Процессов: {len(processes)}, длительность {options['duration']} с")
+        
+        results = self.collect(processes, queue, started + options['duration'] + options['grace'])
+        for process in processes:
+            process.join()
+        
+        report = loadtest.summarize(results, options['interval'])
+        report['worker_errors'] = [
+            {'worker': result['worker'], 'error': result['error']} for result in results if 'error' in result
+        ]
+        report['meta'] = {
+            'label': options['label'],
+            'started_at': timezone.now().isoformat(),
+            'processes': options['processes'],
+            'duration': options['duration'],
+            'interval': options['interval'],
+            'players': options['players'],
+            'mix': mix,
+            'target': options['base_url'] or 'test-client',
+            'databases': sorted(connections.settings),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+        }
+        
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+        
+        self.write_report(report)
+        for failure in report['worker_errors']:
+            self.stderr.write(f"Процесс {failure['worker']}: {failure['error']}")
+        self.stdout.write(self.style.SUCCESS(f"Результаты: {options['output']}"))
+    
+    def collect(self, processes, queue, deadline):
+        #результаты забираются до join, иначе большой payload блокирует очередь;
+        #процесс, умерший без результата или зависший после deadline, не вешает прогон
+        results = {}
+        while len(results) < len(processes):
+            try:
+                result = queue.get(timeout=1.0)
+                results[result['worker']] = result
+                continue
+            except queue_module.Empty:
+                pass
+            
+            overdue = time.time() > deadline
+            stopped = [
+                index for index, process in enumerate(processes)
+                if index not in results and (overdue or not process.is_alive())
+            ]
+            if not stopped:
+                continue
+            
+            #результат мог прийти сразу после таймаута, перед выходом процесса
+            try:
+                while True:
+                    result = queue.get(timeout=0.5)
+                    results[result['worker']] = result
+            except queue_module.Empty:
+                pass
+            
+            for index in stopped:
+                process = processes[index]
+                if index in results:
+                    continue
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+                results[index] = {
+                    'worker': index,
+                    'elapsed': 0.0,
+                    'buckets': {},
+                    'error': f'процесс завершился без результата, код {process.exitcode}',
+                }
+        return [results[index] for index in sorted(results)]
+    
+    def write_report(self, report):
+        rows = [('всего', report['totals'])] + list(report['operations'].items())
+        self.stdout.write(f"{'операция':<16}{'оп/с':>10}{'p50 мс':>10}{'p90 мс':>10}{'p99 мс':>10}{'ошибки':>9}{'блок.':>8}")
+        for name, stats in rows:
+            self.stdout.write(
+                f"{name:<16}{stats['throughput']:>10}{stats['p50_ms']:>10}{stats['p90_ms']:>10}"
+                f"{stats['p99_ms']:>10}{stats['error_rate']:>9.2%}{stats['lock_timeout_rate']:>8.2%}"
+            )
+        
+        self.stdout.write('По времени:')
+        for point in report['timeline']:
+            self.stdout.write(
+                f"  {point['start_s']:>6.0f} с: {point['throughput']} оп/с, p99 {point['p99_ms']} мс, "
+                f"ошибок {point['errors']}, блокировок {point['lock_timeouts']}"
+            )
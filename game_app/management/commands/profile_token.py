@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from game_app.profiling import get_config, make_token
+
+
+class Command(BaseCommand):
+    help = 'Выдает подписанный токен для профилирования запроса'
+    
+    def handle(self, *args, **options):
+        config = get_config()
+        token = make_token()
+        
+        self.stdout.write(token)
+        self.stdout.write(
+            f"Заголовок: {config['HEADER']}: {token} или параметр ?{config['QUERY_PARAM']}=..., "
+            f"действует {config['TOKEN_MAX_AGE']} с"
+        )
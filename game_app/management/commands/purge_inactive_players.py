@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from game_app.profiling import ProfiledCommand
+from game_app.purge import count_inactive, purge_inactive_players
+
+
+class Command(ProfiledCommand):
+    help = 'Удаляет игроков без входа за N дней вместе с бустами, их историей и прогрессом уровней пачками'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365, help='порог неактивности по last_login')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.1, help='пауза между пачками, секунды')
+        parser.add_argument('--dry-run', action='store_true', help='только посчитать строки')
+    
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days должен быть не меньше 1')
+        
+        if options['dry_run']:
+            counts = count_inactive(timezone.now() - timedelta(days=options['days']))
+            self.stdout.write(f"Будет удалено: {self.format_counts(counts)}")
+            return
+        
+        totals = purge_inactive_players(
+            days=options['days'],
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            progress=self.write_progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Удалено: {self.format_counts(totals)}"))
+    
+    def write_progress(self, alias, last_id, totals):
+        self.stdout.write(f"[{alias}] до id {last_id}: {self.format_counts(totals)}")
+    
+    def format_counts(self, counts):
+        names = ('players', 'boosts', 'boost_history', 'tasks', 'levels', 'awards')
+        return ', '.join(f'{name} {counts[name]}' for name in names)
@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import CommandError
+
+from game_app.models import Player
+from game_app.profiling import ProfiledCommand
+
+
+class Command(ProfiledCommand):
+    help = 'Закрывает день: пишет агрегаты входов и сбрасывает daily_points'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='день в формате YYYY-MM-DD, по умолчанию вчера')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        day = None
+        if options['date']:
+            try:
+                day = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Неверная дата: {options['date']}")
+        
+        stats = Player.rollover_daily_points(day=day, chunk_size=options['chunk_size'])
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats.date}: игроков {stats.unique_players}, "
+            f"входов {stats.logins}, баллов {stats.points}"
+        ))
@@ -0,0 +1,26 @@
+from game_app.profiling import ProfiledCommand
+from game_app.scheduler import BoostExpiryScheduler
+
+
+class Command(ProfiledCommand):
+    help = 'Запускает планировщик истечения бустов'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='секунды между опросами')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--once', action='store_true', help='один проход и выход')
+    
+    def handle(self, *args, **options):
+        scheduler = BoostExpiryScheduler(batch_size=options['batch_size'])
+        
+        if options['once']:
+            pending = scheduler.load()
+            expired = scheduler.tick()
+            self.stdout.write(f"Ожидают: {pending}, истекло: {expired}")
+            return
+        
+        self.stdout.write(f"Загружено активных бустов: {scheduler.load()}")
+        try:
+            scheduler.run(poll_interval=options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(f"Остановлен, истекло бустов: {scheduler.expired_total}")
@@ -0,0 +1,68 @@
+import multiprocessing
+
+from django.db import connections
+
+from game_app.jobs import JobWorker, prune_finished, queue_stats, requeue_stale
+from game_app.profiling import ProfiledCommand
+
+
+def worker_main(batch_size, poll_interval):
+    #после fork у процесса свои соединения с базой
+    connections.close_all()
+    try:
+        JobWorker(batch_size=batch_size).run(poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+class Command(ProfiledCommand):
+    help = 'Запускает N процессов-воркеров фоновой очереди'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='одна пачка в текущем процессе')
+        parser.add_argument('--stats', action='store_true', help='только вывести состояние очереди')
+    
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.write_stats()
+            return
+        
+        if options['once']:
+            processed = JobWorker(batch_size=options['batch_size']).run_once()
+            self.stdout.write(f"Выполнено заданий: {processed}")
+            self.write_stats()
+            return
+        
+        requeue_stale()
+        prune_finished()
+        
+        #соединения родителя не должны наследоваться дочерними процессами
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=worker_main, args=(options['batch_size'], options['poll_interval']))
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Запущено воркеров: {len(processes)}")
+        
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+                process.join()
+    
+    def write_stats(self):
+        stats = queue_stats()
+        depth = ', '.join(f'{status}: {count}' for status, count in stats['depth'].items())
+        self.stdout.write(f"Очередь: {depth}")
+        self.stdout.write(
+            f"Старейшее ожидающее: {stats['oldest_pending_age']:.1f} с, "
+            f"задержка avg {stats['latency_avg']:.2f} с, p95 {stats['latency_p95']:.2f} с"
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import CommandError
+
+from game_app import sharding
+from game_app.profiling import ProfiledCommand
+
+
+class Command(ProfiledCommand):
+    help = 'Копирует справочники (BoostType, Level, Award, LevelAward) с default на все шарды'
+    
+    def handle(self, *args, **options):
+        if not sharding.is_sharded():
+            raise CommandError('Шарды не настроены (GAME_SHARD_COUNT)')
+        
+        copied = sharding.sync_catalog()
+        self.stdout.write(self.style.SUCCESS(
+            f"Скопировано строк: {copied} на {len(sharding.shard_aliases())} шардов"
+        ))
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0002_award_level_playertask2_levelaward_playerlevel_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyLoginStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('logins', models.PositiveIntegerField(default=0)),
+                ('points', models.PositiveIntegerField(default=0)),
+                ('unique_players', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='daily_logins',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0003_daily_login_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortRetention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cohort_date', models.DateField(unique=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('d1', models.PositiveIntegerField(default=0)),
+                ('d7', models.PositiveIntegerField(default=0)),
+                ('d30', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['-cohort_date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['first_login'], name='game_app_pl_first_l_fe2f9b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['last_login'], name='game_app_pl_last_lo_f31180_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0004_cohort_retention'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='boost',
+            index=models.Index(fields=['is_active', 'used_at'], name='game_app_bo_is_acti_dd3284_idx'),
+        ),
+    ]
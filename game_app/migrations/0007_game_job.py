@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0006_idempotency_record'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('level_completion', 'Level Completion'), ('boost_grant', 'Boost Grant')], max_length=20)),
+                ('payload', models.JSONField(default=dict)),
+                ('group_key', models.BigIntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claim_token', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='game_app_ga_status_8a558d_idx')],
+            },
+        ),
+    ]
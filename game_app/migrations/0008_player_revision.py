@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0007_game_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
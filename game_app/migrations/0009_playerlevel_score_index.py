@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0008_player_revision'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='playerlevel',
+            index=models.Index(fields=['level', '-score'], name='game_app_pl_level_i_924d20_idx'),
+        ),
+    ]
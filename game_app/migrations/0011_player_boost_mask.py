@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:22
+
+import struct
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_boost_mask(apps, schema_editor):
+    #маска и вектор истечения по уже активным бустам
+    Boost = apps.get_model('game_app', 'Boost')
+    BoostType = apps.get_model('game_app', 'BoostType')
+    Player = apps.get_model('game_app', 'Player')
+    using = schema_editor.connection.alias
+    
+    names = [choice for choice, _ in BoostType._meta.get_field('name').choices]
+    states = {}
+    #типы вне choices бита не имеют, как в BoostType.bit_for
+    active = Boost.objects.using(using).filter(
+        is_active=True, expires_at__gt=timezone.now(), boost_type__name__in=names
+    )
+    for player_id, name, expires_at in active.values_list('player_id', 'boost_type__name', 'expires_at').iterator():
+        mask, slots = states.setdefault(player_id, [0, [0] * len(names)])
+        bit = names.index(name)
+        states[player_id][0] = mask | (1 << bit)
+        slots[bit] = max(slots[bit], int(expires_at.timestamp()))
+    
+    for player_id, (mask, slots) in states.items():
+        Player.objects.using(using).filter(pk=player_id).update(
+            active_boosts=mask,
+            boost_expiry=struct.pack(f'<{len(names)}I', *slots),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0010_shard_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='active_boosts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='boost_expiry',
+            field=models.BinaryField(default=b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'),
+        ),
+        migrations.RunPython(backfill_boost_mask, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0011_player_boost_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boost',
+            name='campaign_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='boost',
+            name='source',
+            field=models.CharField(choices=[('level_completion', 'Level Completion'), ('manual', 'Manual Assignment'), ('daily_reward', 'Daily Reward'), ('purchase', 'Purchase'), ('campaign', 'Live-ops Campaign')], max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='boost',
+            constraint=models.UniqueConstraint(condition=models.Q(('campaign_id__isnull', False)), fields=('player', 'campaign_id'), name='unique_campaign_boost_per_player'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:31
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_players(apps, schema_editor):
+    #перед уникальным индексом: дубли player_id сливаются в строку с наименьшим id
+    PlayerTask2 = apps.get_model('game_app', 'PlayerTask2')
+    PlayerLevel = apps.get_model('game_app', 'PlayerLevel')
+    PlayerAward = apps.get_model('game_app', 'PlayerAward')
+    using = schema_editor.connection.alias
+    
+    duplicated = (
+        PlayerTask2.objects.using(using).values('player_id')
+        .annotate(total=Count('id')).filter(total__gt=1).values_list('player_id', flat=True)
+    )
+    for external_id in list(duplicated):
+        keeper, *duplicates = PlayerTask2.objects.using(using).filter(player_id=external_id).order_by('id').values_list('id', flat=True)
+        
+        #уровень у обоих: прохождение и лучший счет объединяются в строке оставшегося игрока
+        kept_levels = {row.level_id: row for row in PlayerLevel.objects.using(using).filter(player_id=keeper)}
+        for row in PlayerLevel.objects.using(using).filter(player_id__in=duplicates).order_by('id'):
+            kept = kept_levels.get(row.level_id)
+            if kept is None:
+                row.player_id = keeper
+                row.save(update_fields=['player'])
+                kept_levels[row.level_id] = row
+                continue
+            
+            kept.is_completed = kept.is_completed or row.is_completed
+            kept.score = max(kept.score, row.score)
+            kept.completed = min(filter(None, [kept.completed, row.completed]), default=None)
+            kept.save(update_fields=['is_completed', 'score', 'completed'])
+            row.delete()
+        
+        kept_awards = set(
+            PlayerAward.objects.using(using).filter(player_id=keeper).values_list('award_id', 'level_id')
+        )
+        for row in PlayerAward.objects.using(using).filter(player_id__in=duplicates).order_by('id'):
+            if (row.award_id, row.level_id) in kept_awards:
+                row.delete()
+            else:
+                row.player_id = keeper
+                row.save(update_fields=['player'])
+                kept_awards.add((row.award_id, row.level_id))
+        
+        PlayerTask2.objects.using(using).filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0012_boost_campaign'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_players, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    #уникальный индекс отдельной миграцией: в PostgreSQL ALTER TABLE нельзя выполнить в одной
+    #транзакции с изменениями строк из 0013 (pending trigger events)
+
+    dependencies = [
+        ('game_app', '0013_merge_duplicate_player_ids'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='playertask2',
+            name='player_id',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
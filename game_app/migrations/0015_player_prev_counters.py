@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_app', '0014_playertask2_unique_player_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='counters_day',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='prev_logins',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='prev_points',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,9 +1,68 @@
-from django.db import models
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models
 from django.db import transaction
+from django.db.models import Case, Count, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, TruncDate
 from django.http import HttpResponse
 from django.utils import timezone
+from collections import Counter
+from datetime import datetime, time, timedelta, timezone as dt_timezone
 import csv
-import io
+import struct
+
+from .profiling import profile_hook
+from .sharding import ShardedQuerySet, group_by_shard, shard_aliases, shard_for_pk
+
+
+#код ошибки "игрок не найден" в результатах GameService, текст ошибки для людей и может меняться
+PLAYER_NOT_FOUND = 'player_not_found'
+
+
+def player_not_found():
+    return {'success': False, 'error': 'Игрок не найден', 'code': PLAYER_NOT_FOUND}
+
+
+def day_start(day):
+    #начало календарного дня в текущей временной зоне
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+#типы бустов; порядок задает бит в Player.active_boosts и слот в Player.boost_expiry, новые только в конец
+BOOST_TYPES = [
+    ('speed', 'Speed Boost'),
+    ('damage', 'Damage Boost'),
+    ('health', 'Health Boost'),
+    ('experience', 'Experience Boost'),
+    ('coins', 'Coins Boost'),
+]
+
+#вектор истечения бустов: по uint32 (секунды unix) на каждый тип
+BOOST_SLOTS = len(BOOST_TYPES)
+BOOST_EXPIRY_FORMAT = f'<{BOOST_SLOTS}I'
+
+if BOOST_SLOTS > 15:
+    raise ImproperlyConfigured('Player.active_boosts вмещает не больше 15 типов бустов')
+
+
+def unpack_boost_expiry(data):
+    #строки, записанные до добавления типа, короче: недостающие слоты нулевые
+    return list(struct.unpack(BOOST_EXPIRY_FORMAT, bytes(data or b'').ljust(4 * BOOST_SLOTS, b'\0')))
+
+
+def pack_boost_expiry(slots):
+    return struct.pack(BOOST_EXPIRY_FORMAT, *slots)
+
+
+def decode_active_boosts(mask, data, now=None):
+    #маска и вектор -> {тип: время истечения} для еще не истекших бустов
+    now_ts = int((now or timezone.now()).timestamp())
+    slots = unpack_boost_expiry(data)
+    return {
+        name: datetime.fromtimestamp(slots[bit], tz=dt_timezone.utc)
+        for bit, (name, _) in enumerate(BOOST_TYPES)
+        if mask & (1 << bit) and slots[bit] > now_ts
+    }
 
 
 # Первое задание
@@ -16,38 +75,247 @@ class Player(models.Model):
     last_login = models.DateTimeField(null=True, blank=True)
     login_count = models.PositiveIntegerField(default=0)
     daily_points = models.PositiveIntegerField(default=0)  #баллы за ежедневный вход
+    daily_logins = models.PositiveIntegerField(default=0)  #входы за текущий день
+    counters_day = models.DateField(null=True, blank=True)  #день перенесенных счетчиков до закрытия
+    prev_logins = models.PositiveIntegerField(default=0)  #входы прошлого дня, еще не закрытого rollover
+    prev_points = models.PositiveIntegerField(default=0)  #баллы прошлого дня, еще не закрытого rollover
     total_points = models.PositiveIntegerField(default=0)  #общие баллы
+    revision = models.PositiveIntegerField(default=0)  #версия состояния для ETag снимка
+    active_boosts = models.PositiveSmallIntegerField(default=0)  #битовая маска активных типов бустов
+    boost_expiry = models.BinaryField(default=bytes(4 * BOOST_SLOTS))  #упакованное время истечения по типам
+    
+    objects = ShardedQuerySet.as_manager()
+    
+    DAILY_BONUS = 10
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['first_login']),
+            models.Index(fields=['last_login']),
+        ]
     
     def __str__(self):
         return self.username
     
+    @profile_hook()
     def record_login(self):
         now = timezone.now()
+        today_start = day_start(timezone.localdate(now))
+        
+        #бонус только за первый вход за день, условие проверяется в том же UPDATE
+        new_day = Q(last_login__isnull=True) | Q(last_login__lt=today_start)
+        bonus = self.DAILY_BONUS
+        counter = models.PositiveIntegerField()
+        using = self._state.db
+        
+        self._apply_login(using, now, new_day, bonus, counter)
+        
+        #состояние в памяти повторяет UPDATE без повторного чтения
+        if self.last_login is None or self.last_login < today_start:
+            if self.daily_logins:
+                self.counters_day = timezone.localdate(self.last_login)
+                self.prev_logins = self.daily_logins
+                self.prev_points = self.daily_points
+            self.daily_logins = 1
+            self.daily_points = bonus
+            self.total_points += bonus
+        else:
+            self.daily_logins += 1
         
-        #отслеживание первого входа
         if not self.first_login:
             self.first_login = now
         
         self.last_login = now
         self.login_count += 1
+        self.revision += 1
+    
+    def _apply_login(self, using, now, new_day, bonus, counter):
+        #счетчики прошлого дня, еще не закрытые rollover, переносятся в prev_* тем же UPDATE;
+        #last_login идет последним: в SET должны читаться старые значения
+        carry = new_day & Q(daily_logins__gt=0)
+        Player.objects.using(using).filter(pk=self.pk).update(
+            first_login=Coalesce('first_login', Value(now, output_field=models.DateTimeField())),
+            login_count=F('login_count') + 1,
+            counters_day=Case(
+                When(carry, then=TruncDate('last_login')),
+                default=F('counters_day'),
+                output_field=models.DateField(),
+            ),
+            prev_logins=Case(
+                When(carry, then=F('daily_logins')),
+                default=F('prev_logins'),
+                output_field=counter,
+            ),
+            prev_points=Case(
+                When(carry, then=F('daily_points')),
+                default=F('prev_points'),
+                output_field=counter,
+            ),
+            daily_logins=Case(
+                When(new_day, then=Value(1)),
+                default=F('daily_logins') + 1,
+                output_field=counter,
+            ),
+            daily_points=Case(
+                When(new_day, then=Value(bonus)),
+                default=F('daily_points'),
+                output_field=counter,
+            ),
+            total_points=Case(
+                When(new_day, then=F('total_points') + bonus),
+                default=F('total_points'),
+                output_field=counter,
+            ),
+            revision=F('revision') + 1,
+            last_login=now,
+        )
+    
+    def boost_expiry_map(self, now=None):
+        #активные типы бустов и время их истечения без запросов к Boost
+        return decode_active_boosts(self.active_boosts, self.boost_expiry, now)
+    
+    def has_active_boost(self, name, now=None):
+        #проверка по маске и вектору, истекший по времени слот считается неактивным
+        bit = BoostType.bit_for(name)
+        if bit is None or not self.active_boosts & (1 << bit):
+            return False
+        now_ts = (now or timezone.now()).timestamp()
+        return unpack_boost_expiry(self.boost_expiry)[bit] > now_ts
+    
+    @classmethod
+    def load_active_boosts(cls, player_ids, now=None):
+        #активные бусты лобби: один запрос на шард вместо запросов к Boost по каждому игроку
+        now = now or timezone.now()
+        result = {}
+        
+        for alias, ids in group_by_shard(player_ids).items():
+            rows = cls.objects.using(alias).filter(pk__in=ids).values_list('id', 'active_boosts', 'boost_expiry')
+            for player_id, mask, data in rows:
+                result[player_id] = decode_active_boosts(mask, data, now)
         
-        #начисление баллов за первый вход
-        daily_bonus = 10
-        self.daily_points += daily_bonus
-        self.total_points += daily_bonus
+        return result
+    
+    @classmethod
+    def bump_revision(cls, using=None, **lookup):
+        #новая версия состояния: снимок и ETag игрока устаревают
+        return cls.objects.using(using).filter(**lookup).update(revision=F('revision') + 1)
+    
+    @classmethod
+    def rollover_daily_points(cls, day=None, chunk_size=1000):
+        #закрытие дня: агрегаты в DailyLoginStats и сброс дневных счетчиков пачками
+        if day is None:
+            day = timezone.localdate() - timedelta(days=1)
+        
+        end = day_start(day + timedelta(days=1))
+        
+        stats = DailyLoginStats.add(day)
+        
+        for alias in shard_aliases():
+            players = cls.objects.using(alias)
+            last_id = 0
+            
+            while True:
+                #границы пачки по pk, пропуски в нумерации не дают пустых проходов
+                ids = list(players.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+                if not ids:
+                    break
+                
+                chunk = players.filter(id__gt=last_id, id__lte=ids[-1])
+                last_id = ids[-1]
+                
+                with transaction.atomic(using=alias), transaction.atomic():
+                    cls._rollover_chunk(chunk, day, end)
+        
+        stats.refresh_from_db()
+        return stats
+    
+    @staticmethod
+    def _rollover_chunk(chunk, day, end):
+        #закрываются все дни не позже day, в том числе пропущенные запуски: строка статистики на каждый день;
+        #учитываются только еще не сброшенные игроки, повторный запуск безопасен
+        list(chunk.select_for_update().values_list('id', flat=True))
+        totals = {}
+        
+        current = chunk.filter(last_login__lt=end, daily_logins__gt=0).annotate(
+            day=TruncDate('last_login')
+        ).values('day').annotate(
+            players=Count('id'),
+            points=Sum('daily_points'),
+            logins=Sum('daily_logins'),
+        ).order_by()
+        carried = chunk.filter(counters_day__lte=day, prev_logins__gt=0).values(
+            day=F('counters_day')
+        ).annotate(
+            players=Count('id'),
+            points=Sum('prev_points'),
+            logins=Sum('prev_logins'),
+        ).order_by()
+        
+        for row in [*current, *carried]:
+            total = totals.setdefault(row['day'], Counter())
+            total.update({'logins': row['logins'], 'points': row['points'], 'players': row['players']})
+        
+        #сброс меняет снимок состояния игрока, ETag должен смениться
+        chunk.filter(last_login__lt=end).filter(
+            Q(daily_points__gt=0) | Q(daily_logins__gt=0)
+        ).update(daily_points=0, daily_logins=0, revision=F('revision') + 1)
+        chunk.filter(counters_day__lte=day).update(counters_day=None, prev_logins=0, prev_points=0)
         
-        self.save()
+        for stats_day, total in totals.items():
+            DailyLoginStats.add(stats_day, total['logins'], total['points'], total['players'])
+
+
+class DailyLoginStats(models.Model):
+    #дневные агрегаты входов, заполняются при закрытии дня
+    date = models.DateField(unique=True)
+    logins = models.PositiveIntegerField(default=0)
+    points = models.PositiveIntegerField(default=0)
+    unique_players = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-date']
+    
+    def __str__(self):
+        return f"{self.date}: {self.unique_players} игроков"
+    
+    @classmethod
+    def add(cls, day, logins=0, points=0, players=0):
+        #прибавка к агрегатам дня при закрытии дня
+        stats, _ = cls.objects.get_or_create(date=day)
+        if players:
+            cls.objects.filter(pk=stats.pk).update(
+                logins=F('logins') + logins,
+                points=F('points') + points,
+                unique_players=F('unique_players') + players,
+            )
+        return stats
+
+
+class CohortRetention(models.Model):
+    #сводка удержания когорты по дню первого входа
+    cohort_date = models.DateField(unique=True)
+    size = models.PositiveIntegerField(default=0)
+    d1 = models.PositiveIntegerField(default=0)
+    d7 = models.PositiveIntegerField(default=0)
+    d30 = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['-cohort_date']
+    
+    def __str__(self):
+        return f"{self.cohort_date}: {self.size} игроков"
+    
+    def rate(self, days):
+        #доля вернувшихся игроков
+        if not self.size:
+            return 0.0
+        return getattr(self, f'd{days}') / self.size
 
 
 class BoostType(models.Model):
     #бусты
-    BOOST_TYPES = [
-        ('speed', 'Speed Boost'),
-        ('damage', 'Damage Boost'),
-        ('health', 'Health Boost'),
-        ('experience', 'Experience Boost'),
-        ('coins', 'Coins Boost'),
-    ]
+    BOOST_TYPES = BOOST_TYPES
     
     name = models.CharField(max_length=50, choices=BOOST_TYPES, unique=True)
     description = models.TextField(blank=True)
@@ -56,6 +324,12 @@ class BoostType(models.Model):
     
     def __str__(self):
         return self.get_name_display()
+    
+    @classmethod
+    def bit_for(cls, name):
+        #номер бита типа в Player.active_boosts; служебные типы вне BOOST_TYPES бита не имеют
+        names = [choice for choice, _ in cls.BOOST_TYPES]
+        return names.index(name) if name in names else None
 
 
 class Boost(models.Model):
@@ -65,6 +339,7 @@ class Boost(models.Model):
         ('manual', 'Manual Assignment'),
         ('daily_reward', 'Daily Reward'),
         ('purchase', 'Purchase'),
+        ('campaign', 'Live-ops Campaign'),
     ]
     
     player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='boosts')
@@ -76,13 +351,29 @@ class Boost(models.Model):
     used_at = models.DateTimeField(null=True, blank=True)
     expires_at = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=False)
+    campaign_id = models.CharField(max_length=64, null=True, blank=True)  #акция массовой выдачи или job:<pk> задания очереди, один буст на игрока
+    
+    objects = ShardedQuerySet.as_manager()
+    
+    JOB_CAMPAIGN_PREFIX = 'job:'  #ключи начислений очереди заданий, акциям запрещен
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_active', 'used_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['player', 'campaign_id'],
+                condition=Q(campaign_id__isnull=False),
+                name='unique_campaign_boost_per_player',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.player.username} - {self.boost_type.name} x{self.quantity}"
     
+    @profile_hook()
     def activate(self):
         #активатор буста
         if self.quantity > 0 and not self.is_active:
@@ -92,40 +383,187 @@ class Boost(models.Model):
                 minutes=self.boost_type.duration_minutes
             )
             self.quantity -= 1
-            self.save()
+            
+            using = self._state.db
+            bit = BoostType.bit_for(self.boost_type.name)
+            with transaction.atomic(using=using):
+                self.save()
+                
+                #слот типа хранит самое позднее истечение среди активных бустов этого типа
+                player = Player.objects.using(using).select_for_update().only('boost_expiry').get(pk=self.player_id)
+                update = {'revision': F('revision') + 1}
+                if bit is not None:
+                    slots = unpack_boost_expiry(player.boost_expiry)
+                    slots[bit] = max(slots[bit], int(self.expires_at.timestamp()))
+                    update.update(active_boosts=F('active_boosts').bitor(1 << bit), boost_expiry=pack_boost_expiry(slots))
+                Player.objects.using(using).filter(pk=self.player_id).update(**update)
             return True
         return False
     
     def is_expired(self):
         #проверка истечения времени буста
         if self.expires_at and timezone.now() > self.expires_at:
+            if self.is_active:
+                Boost.expire_batch([self.pk], using=self._state.db)
             self.is_active = False
-            self.save()
             return True
         return False
     
+    @classmethod
+    def expire_batch(cls, boost_ids, now=None, using='default'):
+        #пакетное истечение на одном шарде: одно UPDATE и bulk_create истории
+        if now is None:
+            now = timezone.now()
+        
+        with transaction.atomic(using=using):
+            due = list(
+                cls.objects.using(using).select_for_update()
+                .filter(pk__in=boost_ids, is_active=True, expires_at__lte=now)
+                .values_list('id', 'player_id', 'boost_type_id', 'used_at', 'expires_at', 'boost_type__name')
+            )
+            if not due:
+                return []
+            
+            cls.objects.using(using).filter(pk__in=[row[0] for row in due]).update(is_active=False)
+            Player.bump_revision(using=using, pk__in={row[1] for row in due})
+            cls._clear_boost_slots(due, now, using)
+            
+            PlayerBoostHistory.objects.using(using).bulk_create([
+                PlayerBoostHistory(
+                    player_id=player_id,
+                    boost_type_id=boost_type_id,
+                    activated_at=used_at or expires_at,
+                    expired_at=expires_at,
+                )
+                for _, player_id, boost_type_id, used_at, expires_at, _ in due
+            ])
+        
+        return [row[0] for row in due]
+    
+    @staticmethod
+    def _clear_boost_slots(due, now, using):
+        #бит снимается, только если в слоте нет более позднего буста того же типа
+        bits = {}
+        for _, player_id, _, _, _, name in due:
+            bit = BoostType.bit_for(name)
+            if bit is not None:
+                bits.setdefault(player_id, set()).add(bit)
+        
+        now_ts = now.timestamp()
+        players = list(
+            Player.objects.using(using).select_for_update()
+            .filter(pk__in=bits).order_by('pk').only('active_boosts', 'boost_expiry')
+        )
+        changed = []
+        for player in players:
+            slots = unpack_boost_expiry(player.boost_expiry)
+            mask = player.active_boosts
+            for bit in bits[player.pk]:
+                if slots[bit] <= now_ts:
+                    mask &= ~(1 << bit)
+                    slots[bit] = 0
+            if mask != player.active_boosts:
+                player.active_boosts = mask
+                player.boost_expiry = pack_boost_expiry(slots)
+                changed.append(player)
+        
+        Player.objects.using(using).bulk_update(changed, ['active_boosts', 'boost_expiry'])
+    
     @classmethod
     def award_boost_for_level(cls, player, boost_type, level_number, quantity=1):
         #начисление буста за прохождение уровня
-        boost = cls.objects.create(
+        boost = cls.objects.db_manager(player._state.db).create(
             player=player,
             boost_type=boost_type,
             quantity=quantity,
             source='level_completion',
             level_earned=level_number
         )
+        Player.bump_revision(using=player._state.db, pk=player.pk)
         return boost
     
     @classmethod
     def award_boost_manually(cls, player, boost_type, quantity=1):
         #ручное начисление буста
-        boost = cls.objects.create(
+        boost = cls.objects.db_manager(player._state.db).create(
             player=player,
             boost_type=boost_type,
             quantity=quantity,
             source='manual'
         )
+        Player.bump_revision(using=player._state.db, pk=player.pk)
         return boost
+    
+    @classmethod
+    def grant_campaign_boosts(cls, campaign_id, players, boost_type, quantity=1, source='campaign',
+                              chunk_size=5000, progress=None):
+        #массовая выдача: INSERT ... SELECT по пачкам pk из фильтра игроков, повторный запуск ничего не дублирует
+        if campaign_id.startswith(cls.JOB_CAMPAIGN_PREFIX):
+            raise ValueError(f'Префикс {cls.JOB_CAMPAIGN_PREFIX} зарезервирован за очередью заданий')
+        
+        granted = 0
+        
+        for alias in shard_aliases():
+            matching = players.using(alias).order_by()
+            last_id = 0
+            
+            while True:
+                #граница пачки без загрузки самих игроков
+                upper = list(matching.filter(id__gt=last_id).order_by('id').values_list('id', flat=True).distinct()[chunk_size - 1:chunk_size])
+                if upper:
+                    upper = upper[0]
+                else:
+                    upper = matching.filter(id__gt=last_id).aggregate(high=Max('id'))['high']
+                    if upper is None:
+                        break
+                
+                chunk = matching.filter(id__gt=last_id, id__lte=upper)
+                with transaction.atomic(using=alias):
+                    inserted = cls._insert_campaign_chunk(alias, chunk, campaign_id, boost_type, quantity, source)
+                granted += inserted
+                last_id = upper
+                
+                if progress:
+                    progress(alias, last_id, granted)
+        
+        return granted
+    
+    @classmethod
+    def _insert_campaign_chunk(cls, alias, chunk, campaign_id, boost_type, quantity, source):
+        connection = connections[alias]
+        quote = connection.ops.quote_name
+        now = timezone.now()
+        #фильтр по многозначной связи (boosts__..., history__...) повторяет id игрока
+        select_sql, select_params = chunk.values('id').distinct().query.get_compiler(using=alias).as_sql()
+        
+        columns = ['player_id', 'boost_type_id', 'quantity', 'source', 'created_at', 'is_active', 'campaign_id']
+        values = [
+            boost_type.pk,
+            quantity,
+            source,
+            cls._meta.get_field('created_at').get_db_prep_value(now, connection),
+            False,
+            campaign_id,
+        ]
+        table = quote(cls._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} ({', '.join(quote(column) for column in columns)}) "
+            f"SELECT matched.id, {', '.join(['%s'] * len(values))} FROM ({select_sql}) matched "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} existing "
+            f"WHERE existing.{quote('player_id')} = matched.id AND existing.{quote('campaign_id')} = %s)"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, values + list(select_params) + [campaign_id])
+            inserted = cursor.rowcount
+        
+        #снимки состояния меняются только у тех, кому буст действительно добавлен
+        if inserted:
+            Player.objects.using(alias).filter(
+                pk__in=cls.objects.using(alias).filter(
+                    campaign_id=campaign_id, created_at=now, player_id__in=chunk.values('id')
+                ).values('player_id')
+            ).update(revision=F('revision') + 1)
+        return inserted
 
 
 class PlayerBoostHistory(models.Model):
@@ -136,6 +574,8 @@ class PlayerBoostHistory(models.Model):
     expired_at = models.DateTimeField()
     level_used = models.PositiveIntegerField(null=True, blank=True)
     
+    objects = ShardedQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-activated_at']
 
@@ -143,7 +583,9 @@ class PlayerBoostHistory(models.Model):
 #второе задание
 
 class PlayerTask2(models.Model):
-    player_id = models.CharField(max_length=100)
+    player_id = models.CharField(max_length=100, unique=True)  #внешний id матч-серверов
+    
+    objects = ShardedQuerySet.as_manager()
     
     def __str__(self):
         return self.player_id
@@ -174,8 +616,13 @@ class PlayerLevel(models.Model):
     is_completed = models.BooleanField(default=False)
     score = models.PositiveIntegerField(default=0)
     
+    objects = ShardedQuerySet.as_manager()
+    
     class Meta:
         unique_together = ['player', 'level']
+        indexes = [
+            models.Index(fields=['level', '-score']),
+        ]
         
     def __str__(self):
         return f"{self.player.player_id} - {self.level.title}"
@@ -200,6 +647,8 @@ class PlayerAward(models.Model):
     level = models.ForeignKey(Level, on_delete=models.CASCADE)
     received = models.DateField(auto_now_add=True)
     
+    objects = ShardedQuerySet.as_manager()
+    
     class Meta:
         unique_together = ['player', 'award', 'level']
         
@@ -207,115 +656,623 @@ class PlayerAward(models.Model):
         return f"{self.player.player_id} получил {self.award.title} за {self.level.title}"
 
 
+class IdempotencyRecord(models.Model):
+    #сохраненные ответы сервиса для повторных запросов
+    key = models.CharField(max_length=255, unique=True)  #sha256 ключа клиента
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return self.key
+
+
+class GameJob(models.Model):
+    #задание фоновой очереди
+    JOB_KINDS = [
+        ('level_completion', 'Level Completion'),
+        ('boost_grant', 'Boost Grant'),
+    ]
+    
+    JOB_STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=JOB_KINDS)
+    payload = models.JSONField(default=dict)
+    group_key = models.BigIntegerField(null=True, blank=True)  #уровень для группировки заданий
+    status = models.CharField(max_length=10, choices=JOB_STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=64, blank=True, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class ShardSequence(models.Model):
+    #счетчик pk игроков внутри шарда
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
 class GameService:
     #игровая логика
     
+    LEADERBOARD_SIZE = 100  #сколько лучших результатов уровня держится в кэше
+    LEADERBOARD_TIMEOUT = 600
+    EXPORT_HEADER = ['Player ID', 'Level Title', 'Is Completed', 'Received Award']
+    
     @staticmethod
-    @transaction.atomic
-    def assign_award_for_level_completion(player_id, level_id):
-        #награда за прохождение уровня
-        try:
-            player = PlayerTask2.objects.get(id=player_id)
-            level = Level.objects.get(id=level_id)
-            
-            player_level, created = PlayerLevel.objects.get_or_create(
-                player=player,
-                level=level,
-                defaults={'is_completed': True, 'completed': timezone.now().date()}
-            )
+    @profile_hook()
+    def assign_award_for_level_completion(player_id, level_id, idempotency_key=None, level_context=None):
+        #награда за прохождение уровня, повтор с тем же ключом получает первый ответ
+        from .idempotency import idempotency_cache
+        
+        if idempotency_key is not None:
+            key = f'assign_award:{idempotency_key}'
+            cached = idempotency_cache.get(key)
+            if cached is not None:
+                return cached
+        
+        result = GameService._assign_award_for_level_completion(
+            player_id, level_id, idempotency_key, level_context
+        )
+        
+        if idempotency_key is not None and result['success']:
+            idempotency_cache.remember(key, result)
+        
+        return result
+    
+    @staticmethod
+    @profile_hook()
+    def assign_award_by_external_id(external_id, level_id, idempotency_key=None):
+        #то же по внешнему PlayerTask2.player_id матч-сервера
+        return GameService._call_by_external_id(
+            external_id,
+            lambda player_id: GameService.assign_award_for_level_completion(player_id, level_id, idempotency_key),
+        )
+    
+    @staticmethod
+    def _call_by_external_id(external_id, call):
+        #pk из кэша мог устареть после удаления в другом процессе: при коде PLAYER_NOT_FOUND
+        #запись сбрасывается и id один раз разрешается заново по базе
+        from .resolver import player_resolver
+        
+        for attempt in range(2):
+            player_id = player_resolver.resolve(external_id)
+            if player_id is None:
+                return player_not_found()
             
-            if not player_level.is_completed:
-                player_level.is_completed = True
-                player_level.completed = timezone.now().date()
-                player_level.save()
-                
-            level_awards = LevelAward.objects.filter(level=level)
+            result = call(player_id)
+            if attempt or result.get('code') != PLAYER_NOT_FOUND:
+                return result
+            player_resolver.invalidate([external_id])
+        return result
+    
+    @staticmethod
+    @profile_hook()
+    def load_level_context(level_id):
+        #уровень и его награды, можно переиспользовать для нескольких игроков
+        level = Level.objects.get(id=level_id)
+        awards = [
+            level_award.award
+            for level_award in LevelAward.objects.filter(level=level).select_related('award')
+        ]
+        return level, awards
+    
+    @staticmethod
+    def _assign_award_for_level_completion(player_id, level_id, idempotency_key=None, level_context=None):
+        from .idempotency import idempotency_cache
+        
+        alias = shard_for_pk(player_id)
+        try:
+            #транзакция на шарде игрока
+            with transaction.atomic(using=alias):
+                player = PlayerTask2.objects.using(alias).get(id=player_id)
+                if level_context is None:
+                    level_context = GameService.load_level_context(level_id)
+                level, level_awards = level_context
             
-            awards_received = []
-            for level_award in level_awards:
-                player_award, award_created = PlayerAward.objects.get_or_create(
+                player_level, created = PlayerLevel.objects.using(alias).get_or_create(
                     player=player,
-                    award=level_award.award,
-                    level=level
+                    level=level,
+                    defaults={'is_completed': True, 'completed': timezone.now().date()}
                 )
+            
+                changed = created
+                if not player_level.is_completed:
+                    player_level.is_completed = True
+                    player_level.completed = timezone.now().date()
+                    player_level.save()
+                    changed = True
                 
-                if award_created:
-                    awards_received.append(level_award.award)
-                    
-            return {
-                'success': True,
-                'player': player.player_id,
-                'level': level.title,
-                'award': [award.title for award in awards_received]
-            }
+                awards_received = []
+                for award in level_awards:
+                    player_award, award_created = PlayerAward.objects.using(alias).get_or_create(
+                        player=player,
+                        award=award,
+                        level=level
+                    )
+                
+                    if award_created:
+                        awards_received.append(award)
+            
+                #игрок первого задания сопоставляется по username == player_id
+                if changed or awards_received:
+                    Player.bump_revision(using=alias, username=player.player_id)
+            
+                result = {
+                    'success': True,
+                    'player': player.player_id,
+                    'level': level.title,
+                    'award': [award.title for award in awards_received]
+                }
+            
+                #без шардов ответ фиксируется в той же транзакции, что и награды
+                if idempotency_key is not None:
+                    result = idempotency_cache.store(f'assign_award:{idempotency_key}', result)
+            
+                return result
         
         except PlayerTask2.DoesNotExist:
-            return {'success': False, 'error': 'Игрок не найден'}
+            return player_not_found()
         except Level.DoesNotExist:
             return {'success': False, 'error': 'Уровень не найден'}
         except Exception as e:
             return {'success': False, 'error': str(e)}
         
     @staticmethod
-    def export_player_level_data_to_csv():
-        #csv выгрузка
-        response = HttpResponse(content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="player_level_data.csv"'
+    @profile_hook()
+    def submit_score(player_id, level_id, score):
+        #лучший результат: один условный UPDATE, запись только если счет выше
+        if score < 0:
+            return {'success': False, 'error': 'Отрицательный счет'}
+        
+        alias = shard_for_pk(player_id)
+        improved = PlayerLevel.objects.using(alias).filter(
+            player_id=player_id, level_id=level_id, score__lt=score
+        ).update(score=score)
+        
+        if not improved:
+            best = PlayerLevel.objects.using(alias).filter(
+                player_id=player_id, level_id=level_id
+            ).values_list('score', flat=True).first()
+            
+            if best is not None:
+                return {'success': True, 'improved': False, 'best': best}
+            if not PlayerTask2.objects.using(alias).filter(pk=player_id).exists():
+                return player_not_found()
+            if not Level.objects.using(alias).filter(pk=level_id).exists():
+                return {'success': False, 'error': 'Уровень не найден'}
+            
+            player_level, improved = PlayerLevel.objects.using(alias).get_or_create(
+                player_id=player_id, level_id=level_id, defaults={'score': score}
+            )
+            if not improved:
+                return GameService.submit_score(player_id, level_id, score)
+        
+        Player.bump_revision(
+            using=alias,
+            username__in=PlayerTask2.objects.using(alias).filter(pk=player_id).values('player_id'),
+        )
+        GameService.invalidate_leaderboards_for_scores({level_id: score})
+        
+        return {'success': True, 'improved': True, 'best': score}
+    
+    @staticmethod
+    @profile_hook()
+    def submit_scores(entries):
+        #пакет результатов матча: (player_id, level_id, score), один UPDATE с GREATEST на шард
+        best = {}
+        for player_id, level_id, score in entries:
+            if score < 0:
+                return {'success': False, 'error': 'Отрицательный счет'}
+            best[(player_id, level_id)] = max(score, best.get((player_id, level_id), 0))
+        
+        improved = {}
+        rejected = 0
+        for alias, pairs in group_by_shard(best, key=lambda pair: shard_for_pk(pair[0])).items():
+            shard_improved, shard_rejected = GameService._submit_scores_on_shard(
+                alias, {pair: best[pair] for pair in pairs}
+            )
+            improved.update(shard_improved)
+            rejected += shard_rejected
+        
+        top_scores = {}
+        for (_, level_id), score in improved.items():
+            top_scores[level_id] = max(score, top_scores.get(level_id, 0))
+        GameService.invalidate_leaderboards_for_scores(top_scores)
+        
+        return {
+            'success': True,
+            'submitted': len(best),
+            'rejected': rejected,
+            'improved': sorted(improved),
+        }
+    
+    @staticmethod
+    @profile_hook()
+    def submit_score_by_external_id(external_id, level_id, score):
+        return GameService._call_by_external_id(
+            external_id, lambda player_id: GameService.submit_score(player_id, level_id, score)
+        )
+    
+    @staticmethod
+    @profile_hook()
+    def submit_scores_by_external_id(entries):
+        #пакет матча с внешними id: все id разрешаются одним IN на шард
+        from .resolver import player_resolver
+        
+        entries = list(entries)
+        players = player_resolver.resolve_many(entry[0] for entry in entries)
+        
+        result = GameService.submit_scores(
+            (players[external_id], level_id, score)
+            for external_id, level_id, score in entries if external_id in players
+        )
+        if not result['success']:
+            return result
+        external_ids = {player_id: external_id for external_id, player_id in players.items()}
+        result['improved'] = sorted((external_ids[player_id], level_id) for player_id, level_id in result['improved'])
+        result['unknown'] = sorted({entry[0] for entry in entries if entry[0] not in players})
+        return result
+    
+    @staticmethod
+    def _submit_scores_on_shard(alias, best):
+        players = {pair[0] for pair in best}
+        levels = {pair[1] for pair in best}
+        
+        def current_rows():
+            return {
+                (player_id, level_id): (pk, score)
+                for pk, player_id, level_id, score in PlayerLevel.objects.using(alias).filter(
+                    player_id__in=players, level_id__in=levels
+                ).values_list('id', 'player_id', 'level_id', 'score')
+                if (player_id, level_id) in best
+            }
         
-        #буферизация
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        #заголовки
-        writer.writerow([
-            'Player ID',
-            'Level Title',
-            'Is Completed',
-            'Received Award'
-        ])
-        
-        batch_size = 1000
-        offset = 0
-        
-        while True:
-            #запросы батчами
-            player_levels = PlayerLevel.objects.select_related(
-                'player', 'level'
-            ).prefetch_related(
-                'player__playeraward_set__award'
-            )[offset:offset + batch_size]
+        with transaction.atomic(using=alias):
+            rows = current_rows()
+            missing = [pair for pair in best if pair not in rows]
             
-            if not player_levels:
-                break
+            if missing:
+                known_players = set(PlayerTask2.objects.using(alias).filter(pk__in=players).values_list('id', flat=True))
+                known_levels = set(Level.objects.using(alias).filter(pk__in=levels).values_list('id', flat=True))
+                PlayerLevel.objects.using(alias).bulk_create(
+                    [
+                        PlayerLevel(player_id=player_id, level_id=level_id)
+                        for player_id, level_id in missing
+                        if player_id in known_players and level_id in known_levels
+                    ],
+                    ignore_conflicts=True,
+                )
+                rows = current_rows()
             
-            #награды за текущий уровень
-            for player_level in player_levels:
-                player_awards = PlayerAward.objects.filter(
-                    player=player_level.player,
-                    level=player_level.level
-                ).select_related('award')
+            improved = {pair: best[pair] for pair, (pk, score) in rows.items() if best[pair] > score}
+            if improved:
+                #GREATEST защищает от гонки с одиночными отправками
+                PlayerLevel.objects.using(alias).filter(pk__in=[rows[pair][0] for pair in improved]).update(
+                    score=Greatest(
+                        F('score'),
+                        Case(
+                            *[When(pk=rows[pair][0], then=Value(score)) for pair, score in improved.items()],
+                            output_field=models.PositiveIntegerField(),
+                        ),
+                    )
+                )
+                Player.bump_revision(using=alias, username__in=PlayerTask2.objects.using(alias).filter(
+                    pk__in={pair[0] for pair in improved}
+                ).values('player_id'))
+        
+        return improved, len(best) - len(rows)
+    
+    @staticmethod
+    def _leaderboard_version(level_id):
+        #версия top-K уровня; начальное значение от времени, чтобы после вытеснения не повторить старую
+        key = f'leaderboard-version:{level_id}'
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, int(timezone.now().timestamp() * 1000000), None)
+            version = cache.get(key)
+        return version
+    
+    @staticmethod
+    def _leaderboard_key(level_id, version):
+        return f'leaderboard:{level_id}:{version}'
+    
+    @staticmethod
+    def _build_leaderboard(level_id, version):
+        #top-K по индексу (level, -score) с каждого шарда и слияние
+        entries = []
+        for alias in shard_aliases():
+            entries.extend(
+                list(row) for row in PlayerLevel.objects.using(alias).filter(level_id=level_id, score__gt=0)
+                .order_by('-score', 'player_id')
+                .values_list('player_id', 'player__player_id', 'score')[:GameService.LEADERBOARD_SIZE]
+            )
+        entries.sort(key=lambda entry: (-entry[2], entry[0]))
+        entries = entries[:GameService.LEADERBOARD_SIZE]
+        #версия прочитана до запроса: если счет сменился во время сборки, список ляжет под устаревший ключ
+        cache.set(GameService._leaderboard_key(level_id, version), entries, GameService.LEADERBOARD_TIMEOUT)
+        return entries
+    
+    @staticmethod
+    def invalidate_leaderboards(level_ids):
+        #новая версия вместо правки списка в кэше: incr атомарен, параллельные записи не теряются
+        for level_id in level_ids:
+            try:
+                cache.incr(f'leaderboard-version:{level_id}')
+            except ValueError:
+                pass  #версии нет - при чтении будет новая
+    
+    @staticmethod
+    def invalidate_leaderboards_for_scores(scores):
+        #{level_id: лучший новый счет}: версия меняется, только если счет входит в закэшированный top-K;
+        #без списка в кэше версия меняется всегда - сборка могла идти параллельно с записью
+        changed = []
+        for level_id, score in scores.items():
+            version = cache.get(f'leaderboard-version:{level_id}')
+            if version is None:
+                continue
+            entries = cache.get(GameService._leaderboard_key(level_id, version))
+            if entries is None or len(entries) < GameService.LEADERBOARD_SIZE or score >= entries[-1][2]:
+                changed.append(level_id)
+        GameService.invalidate_leaderboards(changed)
+    
+    @staticmethod
+    @profile_hook()
+    def get_level_leaderboard(level_id, limit=10):
+        #лучшие результаты уровня из кэша top-K
+        version = GameService._leaderboard_version(level_id)
+        entries = cache.get(GameService._leaderboard_key(level_id, version))
+        if entries is None:
+            entries = GameService._build_leaderboard(level_id, version)
+        
+        return [
+            {'rank': rank, 'player': external_id, 'score': score}
+            for rank, (_, external_id, score) in enumerate(entries[:limit], start=1)
+        ]
+    
+    @staticmethod
+    @profile_hook()
+    def get_player_percentile(player_id, level_id):
+        #доля игроков уровня с результатом ниже, считается по индексу (level, score)
+        score = PlayerLevel.objects.using(shard_for_pk(player_id)).filter(
+            player_id=player_id, level_id=level_id
+        ).values_list('score', flat=True).first()
+        if score is None:
+            return None
+        
+        counts = {'total': 0, 'below': 0, 'above': 0}
+        for alias in shard_aliases():
+            shard_counts = PlayerLevel.objects.using(alias).filter(level_id=level_id).aggregate(
+                total=Count('id'),
+                below=Count('id', filter=Q(score__lt=score)),
+                above=Count('id', filter=Q(score__gt=score)),
+            )
+            for name, value in shard_counts.items():
+                counts[name] += value
+        
+        return {
+            'score': score,
+            'percentile': 100.0 * counts['below'] / counts['total'],
+            'rank': counts['above'] + 1,
+        }
+    
+    @staticmethod
+    @profile_hook()
+    def get_progression_map(player_id):
+        #все уровни по порядку с прохождением, счетом и наградами игрока
+        maps = GameService.get_progression_maps([player_id])
+        if player_id not in maps:
+            return player_not_found()
+        return maps[player_id]
+    
+    @staticmethod
+    @profile_hook()
+    def get_progression_maps_by_external_id(external_ids):
+        #{внешний id: карта прогресса}, неизвестные id пропускаются
+        from .resolver import player_resolver
+        
+        players = player_resolver.resolve_many(external_ids)
+        maps = GameService.get_progression_maps(players.values())
+        return {external_id: maps[player_id] for external_id, player_id in players.items() if player_id in maps}
+    
+    @staticmethod
+    @profile_hook()
+    def get_progression_maps(player_ids, chunk_size=500):
+        #карты прогресса многих игроков: три запроса на пачку шарда поверх справочника уровней;
+        #неизвестные id пропускаются
+        from .catalog import level_catalog
+        
+        levels = level_catalog.levels()
+        player_ids = list(dict.fromkeys(player_ids))
+        
+        known = set()
+        progress = {}
+        received = {}
+        for alias, shard_ids in group_by_shard(player_ids).items():
+            for start in range(0, len(shard_ids), chunk_size):
+                chunk = shard_ids[start:start + chunk_size]
+                known.update(PlayerTask2.objects.using(alias).filter(pk__in=chunk).values_list('id', flat=True))
                 
-                #строка для каждой награды, если есть
-                if player_awards.exists():
-                    for player_award in player_awards:
-                        writer.writerow([
-                            player_level.player.player_id,
-                            player_level.level.title,
-                            'Да' if player_level.is_completed else 'Нет',
-                            player_award.award.title
-                        ])
-                else:
-                    # строки без награды, если ее нет
-                    writer.writerow([
-                        player_level.player.player_id,
-                        player_level.level.title,
-                        'Да' if player_level.is_completed else 'Нет',
-                        'Нет награды'
-                    ])
-            offset += batch_size
+                for player_id, level_id, is_completed, completed, score in PlayerLevel.objects.using(alias).filter(
+                    player_id__in=chunk
+                ).values_list('player_id', 'level_id', 'is_completed', 'completed', 'score'):
+                    progress[(player_id, level_id)] = (is_completed, completed, score)
+                
+                for player_id, level_id, award_id in PlayerAward.objects.using(alias).filter(
+                    player_id__in=chunk
+                ).values_list('player_id', 'level_id', 'award_id'):
+                    received.setdefault((player_id, level_id), set()).add(award_id)
+        
+        maps = {}
+        for player_id in player_ids:
+            if player_id not in known:
+                continue
+            
+            entries = []
+            next_level = None
+            
+            for level in levels:
+                is_completed, completed, score = progress.get((player_id, level['id']), (False, None, 0))
+                got = received.get((player_id, level['id']), set())
+                
+                entries.append({
+                    'level': level['id'],
+                    'title': level['title'],
+                    'order': level['order'],
+                    'completed': is_completed,
+                    'completed_on': completed.isoformat() if completed else None,
+                    'score': score,
+                    'awards_received': [title for award_id, title in level['awards'] if award_id in got],
+                    #награды пройденного уровня, которые игрок еще не получил
+                    'awards_pending': [
+                        title for award_id, title in level['awards']
+                        if is_completed and award_id not in got
+                    ],
+                })
+                
+                if next_level is None and not is_completed:
+                    next_level = level['id']
+            
+            maps[player_id] = {
+                'player': player_id,
+                'levels': entries,
+                'completed': sum(1 for entry in entries if entry['completed']),
+                'next_level': next_level,
+            }
+        
+        return maps
+    
+    @staticmethod
+    @profile_hook()
+    def get_player_snapshot(player_id, revision=None):
+        #компактный снимок состояния игрока, кэшируется по номеру версии
+        if revision is not None:
+            snapshot = cache.get(f'player-state:{player_id}:{revision}')
+            if snapshot is not None:
+                return snapshot
+        
+        alias = shard_for_pk(player_id)
+        player = Player.objects.using(alias).filter(pk=player_id).values(
+            'id', 'username', 'revision', 'login_count', 'daily_points', 'total_points'
+        ).first()
+        if player is None:
+            return None
+        
+        #фиксированное число запросов: игрок, бусты, уровни, награды
+        boosts = Boost.objects.using(alias).filter(player_id=player_id).filter(
+            Q(is_active=True) | Q(quantity__gt=0)
+        ).values('id', 'boost_type__name', 'boost_type__multiplier', 'quantity', 'is_active', 'expires_at')
+        levels = PlayerLevel.objects.using(alias).filter(player__player_id=player['username']).values(
+            'level_id', 'level__title', 'level__order', 'is_completed', 'completed', 'score'
+        ).order_by('level__order')
+        awards = PlayerAward.objects.using(alias).filter(player__player_id=player['username']).values(
+            'award_id', 'award__title', 'level_id', 'received'
+        )
+        
+        snapshot = {
+            'player': player['id'],
+            'username': player['username'],
+            'revision': player['revision'],
+            'login_count': player['login_count'],
+            'points': {'daily': player['daily_points'], 'total': player['total_points']},
+            'active_boosts': [
+                {
+                    'id': boost['id'],
+                    'type': boost['boost_type__name'],
+                    'multiplier': boost['boost_type__multiplier'],
+                    'expires_at': boost['expires_at'].isoformat() if boost['expires_at'] else None,
+                }
+                for boost in boosts if boost['is_active']
+            ],
+            'inventory': [
+                {'id': boost['id'], 'type': boost['boost_type__name'], 'quantity': boost['quantity']}
+                for boost in boosts if boost['quantity'] > 0
+            ],
+            'levels': [
+                {
+                    'level': level['level_id'],
+                    'title': level['level__title'],
+                    'order': level['level__order'],
+                    'completed': level['is_completed'],
+                    'completed_on': level['completed'].isoformat() if level['completed'] else None,
+                    'score': level['score'],
+                }
+                for level in levels
+            ],
+            'awards': [
+                {
+                    'award': award['award_id'],
+                    'title': award['award__title'],
+                    'level': award['level_id'],
+                    'received': award['received'].isoformat(),
+                }
+                for award in awards
+            ],
+        }
+        
+        cache.set(f"player-state:{player_id}:{snapshot['revision']}", snapshot, 300)
+        return snapshot
+    
+    @staticmethod
+    def iter_player_level_rows(chunk_size=1000):
+        #строки выгрузки: пачка уровней по pk и одним запросом все награды пачки
+        for alias in shard_aliases():
+            last_id = 0
             
-        #запись данных
-        response.write(output.getvalue())
-        output.close()
+            while True:
+                player_levels = list(
+                    PlayerLevel.objects.using(alias).filter(id__gt=last_id).order_by('id')
+                    .values_list('id', 'player_id', 'level_id', 'player__player_id', 'level__title', 'is_completed')
+                    [:chunk_size]
+                )
+                if not player_levels:
+                    break
+                last_id = player_levels[-1][0]
+                
+                awards = {}
+                for player_id, level_id, title in PlayerAward.objects.using(alias).filter(
+                    player_id__in={row[1] for row in player_levels},
+                    level_id__in={row[2] for row in player_levels},
+                ).order_by('id').values_list('player_id', 'level_id', 'award__title'):
+                    awards.setdefault((player_id, level_id), []).append(title)
+                
+                for _, player_id, level_id, external_id, level_title, is_completed in player_levels:
+                    completed = 'Да' if is_completed else 'Нет'
+                    #строка для каждой награды или одна строка без награды
+                    for title in awards.get((player_id, level_id), ['Нет награды']):
+                        yield [external_id, level_title, completed, title]
+                
+                if len(player_levels) < chunk_size:
+                    break
+    
+    @staticmethod
+    @profile_hook()
+    def export_player_level_data_to_csv():
+        #csv выгрузка
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="player_level_data.csv"'
+        
+        writer = csv.writer(response)
+        writer.writerow(GameService.EXPORT_HEADER)
+        writer.writerows(GameService.iter_player_level_rows())
         
         return response
\ No newline at end of file
@@ -0,0 +1,251 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from django.utils.text import slugify
+
+
+DEFAULTS = {
+    'OUTPUT_DIR': None,  #по умолчанию BASE_DIR / 'profiles'
+    'MAX_PER_MINUTE': 6,
+    'HEADER': 'X-Game-Profile',
+    'QUERY_PARAM': '_profile',
+    'TOKEN_MAX_AGE': 3600,
+}
+
+SIGNING_SALT = 'game_app.profiling'
+
+_current_session = ContextVar('game_profile_session', default=None)
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'GAME_PROFILING', {})}
+    if config['OUTPUT_DIR'] is None:
+        config['OUTPUT_DIR'] = Path(settings.BASE_DIR) / 'profiles'
+    return config
+
+
+def make_token():
+    #подписанный токен для заголовка или параметра запроса
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign('profile')
+
+
+def is_valid_token(token):
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(token, max_age=get_config()['TOKEN_MAX_AGE'])
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class RateLimiter:
+    #не больше MAX_PER_MINUTE профилей в минуту на процесс
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+    
+    def allow(self):
+        limit = get_config()['MAX_PER_MINUTE']
+        now = time.monotonic()
+        with self.lock:
+            self.started = [moment for moment in self.started if now - moment < 60]
+            if len(self.started) >= limit:
+                return False
+            self.started.append(now)
+            return True
+
+
+rate_limiter = RateLimiter()
+
+
+def frame_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        return name.replace(';', ',')
+    return f'{os.path.basename(filename)}:{lineno}:{name}'.replace(';', ',')
+
+
+def collapsed_stacks(stats):
+    #cProfile не хранит полные стеки: путь восстанавливается по самому тяжелому вызывающему
+    lines = []
+    for func, (_, _, tottime, _, callers) in stats.stats.items():
+        if tottime <= 0:
+            continue
+        
+        path = [func]
+        seen = {func}
+        while callers:
+            caller = max(callers, key=lambda item: callers[item][3])
+            if caller in seen:
+                break
+            path.append(caller)
+            seen.add(caller)
+            callers = stats.stats.get(caller, (0, 0, 0, 0, {}))[4]
+        
+        stack = ';'.join(frame_label(item) for item in reversed(path))
+        lines.append(f'{stack} {int(tottime * 1000000)}')
+    return lines
+
+
+class ProfileSession:
+    #cProfile + все SQL-запросы за время выполнения
+    
+    def __init__(self, name):
+        self.name = name
+        self.id = f"{timezone.now():%Y%m%d-%H%M%S}-{slugify(name)[:60]}-{uuid.uuid4().hex[:6]}"
+        self.profiler = cProfile.Profile()
+        self.queries = []
+        self.spans = []
+        self.span_stack = []
+        self.paths = {}
+        self._exit_stack = None
+        self._token = None
+    
+    def _capture_sql(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': repr(params)[:500],
+                'many': many,
+                'alias': context['connection'].alias,
+                'span': self.span_stack[-1] if self.span_stack else None,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+            })
+    
+    @contextmanager
+    def span(self, label):
+        #отрезок времени помеченного метода
+        started = time.perf_counter()
+        queries_before = len(self.queries)
+        self.span_stack.append(label)
+        try:
+            yield
+        finally:
+            self.span_stack.pop()
+            self.spans.append({
+                'label': label,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+                'queries': len(self.queries) - queries_before,
+            })
+    
+    def __enter__(self):
+        self._token = _current_session.set(self)
+        self._exit_stack = ExitStack()
+        for connection in connections.all():
+            self._exit_stack.enter_context(connection.execute_wrapper(self._capture_sql))
+        self.profiler.enable()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self._exit_stack.close()
+        _current_session.reset(self._token)
+        self.save()
+        return False
+    
+    def save(self):
+        output_dir = Path(get_config()['OUTPUT_DIR'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        base = output_dir / self.id
+        
+        self.paths = {
+            'pstats': f'{base}.pstats',
+            'collapsed': f'{base}.collapsed',
+            'sql': f'{base}.sql.json',
+        }
+        
+        self.profiler.dump_stats(self.paths['pstats'])
+        
+        with open(self.paths['collapsed'], 'w') as target:
+            target.write('\n'.join(collapsed_stacks(pstats.Stats(self.profiler))) + '\n')
+        
+        with open(self.paths['sql'], 'w') as target:
+            json.dump({
+                'name': self.name,
+                'query_count': len(self.queries),
+                'sql_time_ms': sum(query['duration_ms'] for query in self.queries),
+                'spans': self.spans,
+                'queries': self.queries,
+            }, target, ensure_ascii=False, indent=1)
+
+
+def current_session():
+    return _current_session.get()
+
+
+def profile_hook(label=None):
+    #метка метода в профиле; без активной сессии - один lookup ContextVar
+    def decorator(func):
+        name = label or func.__qualname__
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            session = _current_session.get()
+            if session is None:
+                return func(*args, **kwargs)
+            with session.span(name):
+                return func(*args, **kwargs)
+        
+        return wrapper
+    return decorator
+
+
+class ProfilingMiddleware:
+    #профилирование запроса по подписанному заголовку или параметру
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        config = get_config()
+        token = request.headers.get(config['HEADER']) or request.GET.get(config['QUERY_PARAM'])
+        
+        if not token or current_session() is not None or not is_valid_token(token) or not rate_limiter.allow():
+            return self.get_response(request)
+        
+        with ProfileSession(f'{request.method} {request.path}') as session:
+            response = self.get_response(request)
+        
+        response['X-Game-Profile-Id'] = session.id
+        return response
+
+
+class ProfiledCommand(BaseCommand):
+    #базовая команда с флагом --profile
+    
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument('--profile', action='store_true', help='сохранить профиль выполнения')
+        return parser
+    
+    def execute(self, *args, **options):
+        if not options.get('profile'):
+            return super().execute(*args, **options)
+        
+        if not rate_limiter.allow():
+            self.stderr.write('Лимит профилирования исчерпан, выполнение без профиля')
+            return super().execute(*args, **options)
+        
+        name = 'command ' + self.__module__.rsplit('.', 1)[-1]
+        with ProfileSession(name) as session:
+            result = super().execute(*args, **options)
+        
+        self.stderr.write(f"Профиль сохранен: {session.paths['pstats']}")
+        return result
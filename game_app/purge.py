@@ -0,0 +1,98 @@
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Boost, GameService, Player, PlayerAward, PlayerBoostHistory, PlayerLevel, PlayerTask2
+from .sharding import shard_aliases
+
+
+#имя счетчика по модели из результата delete()
+COUNTERS = {
+    Player._meta.label: 'players',
+    Boost._meta.label: 'boosts',
+    PlayerBoostHistory._meta.label: 'boost_history',
+    PlayerTask2._meta.label: 'tasks',
+    PlayerLevel._meta.label: 'levels',
+    PlayerAward._meta.label: 'awards',
+}
+
+
+def inactive_filter(cutoff):
+    #не заходили с cutoff или не заходили ни разу и созданы раньше cutoff
+    return Q(last_login__lt=cutoff) | Q(last_login__isnull=True, created_at__lt=cutoff)
+
+
+def count_inactive(cutoff):
+    #оценка для --dry-run: игроки и зависимые строки по шардам
+    counts = Counter()
+    for alias in shard_aliases():
+        players = Player.objects.using(alias).filter(inactive_filter(cutoff))
+        tasks = PlayerTask2.objects.using(alias).filter(player_id__in=players.values('username'))
+        
+        counts['players'] += players.count()
+        counts['boosts'] += Boost.objects.using(alias).filter(player__in=players).count()
+        counts['boost_history'] += PlayerBoostHistory.objects.using(alias).filter(player__in=players).count()
+        counts['tasks'] += tasks.count()
+        counts['levels'] += PlayerLevel.objects.using(alias).filter(player__in=tasks).count()
+        counts['awards'] += PlayerAward.objects.using(alias).filter(player__in=tasks).count()
+    return counts
+
+
+def purge_inactive_players(days=365, chunk_size=500, pause=0.0, progress=None):
+    #удаление пачками: каждая пачка в своей короткой транзакции
+    cutoff = timezone.now() - timedelta(days=days)
+    totals = Counter()
+    
+    for alias in shard_aliases():
+        players = Player.objects.using(alias).filter(inactive_filter(cutoff))
+        last_id = 0
+        
+        while True:
+            ids = list(players.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            
+            deleted, level_ids = purge_chunk(alias, ids, cutoff)
+            totals.update(deleted)
+            
+            #лидерборды уровней с результатами удаленных игроков пересобираются при следующем чтении
+            GameService.invalidate_leaderboards(level_ids)
+            
+            if progress:
+                progress(alias, last_id, totals)
+            if pause:
+                time.sleep(pause)
+    
+    return totals
+
+
+def purge_chunk(alias, ids, cutoff):
+    #обычный delete() пачки: каскад и сигналы Django, зависимые таблицы без обработчиков
+    #удаляются одним DELETE на таблицу без загрузки строк; прогресс PlayerTask2 - по username
+    deleted = Counter()
+    with transaction.atomic(using=alias):
+        #игрок мог зайти после выборки пачки
+        rows = list(
+            Player.objects.using(alias).select_for_update()
+            .filter(inactive_filter(cutoff), pk__in=ids).values_list('id', 'username')
+        )
+        if not rows:
+            return deleted, set()
+        
+        tasks = PlayerTask2.objects.using(alias).filter(player_id__in=[username for _, username in rows])
+        level_ids = set(
+            PlayerLevel.objects.using(alias).filter(player__in=tasks, score__gt=0)
+            .values_list('level_id', flat=True).distinct()
+        )
+        
+        _, by_tasks = tasks.delete()
+        _, by_players = Player.objects.using(alias).filter(pk__in=[pk for pk, _ in rows]).delete()
+    
+    for label, count in [*by_tasks.items(), *by_players.items()]:
+        deleted[COUNTERS.get(label, label)] += count
+    return deleted, level_ids
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .models import PlayerTask2
+from .sharding import group_by_shard, shard_for_key
+
+
+class PlayerIdResolver:
+    #внешний PlayerTask2.player_id -> pk: ограниченный LRU в памяти процесса поверх уникального индекса
+    #связь id и pk не меняется, пока строка жива; удаления в этом процессе сбрасывают запись сигналом,
+    #удаления в других процессах видны по TTL или при повторе после "игрок не найден"
+    
+    def __init__(self, max_size=10000, batch_size=500, ttl=300):
+        self.max_size = max_size
+        self.batch_size = batch_size  #размер IN на один запрос
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def resolve(self, external_id):
+        return self.resolve_many([external_id]).get(external_id)
+    
+    def resolve_many(self, external_ids):
+        #{внешний id: pk}; неизвестные id в ответ не попадают и не кэшируются
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self.lock:
+            for external_id in dict.fromkeys(external_ids):
+                pk, expires_at = self.entries.get(external_id, (None, 0))
+                if pk is None or expires_at <= now:
+                    self.entries.pop(external_id, None)
+                    missing.append(external_id)
+                else:
+                    self.entries.move_to_end(external_id)
+                    found[external_id] = pk
+            self.hits += len(found)
+            self.misses += len(missing)
+        
+        for alias, group in group_by_shard(missing, key=shard_for_key).items():
+            for start in range(0, len(group), self.batch_size):
+                rows = dict(
+                    PlayerTask2.objects.using(alias)
+                    .filter(player_id__in=group[start:start + self.batch_size])
+                    .values_list('player_id', 'id')
+                )
+                found.update(rows)
+                self._remember(rows)
+        
+        return found
+    
+    def _remember(self, rows):
+        expires_at = time.monotonic() + self.ttl
+        with self.lock:
+            for external_id, pk in rows.items():
+                self.entries[external_id] = (pk, expires_at)
+                self.entries.move_to_end(external_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, external_ids=None):
+        with self.lock:
+            if external_ids is None:
+                self.entries.clear()
+                return
+            for external_id in external_ids:
+                self.entries.pop(external_id, None)
+    
+    def invalidate_on_delete(self, sender, instance, **kwargs):
+        self.invalidate([instance.player_id])
+    
+    def stats(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+player_resolver = PlayerIdResolver()
@@ -0,0 +1,50 @@
+from .sharding import CATALOG, PLAYER_OWNED, PLAYER_ROOTS, shard_for_key, shard_for_pk
+
+
+class PlayerShardRouter:
+    #строки игрока на шарде по хэшу его внешнего id, справочники и служебные таблицы на default
+    
+    def _alias_for_instance(self, instance):
+        if instance._state.db:
+            return instance._state.db
+        
+        model_name = instance._meta.model_name
+        if model_name in PLAYER_ROOTS:
+            if instance.pk is not None:
+                return shard_for_pk(instance.pk)
+            return shard_for_key(getattr(instance, PLAYER_ROOTS[model_name]))
+        
+        player_id = getattr(instance, 'player_id', None)
+        if player_id is not None:
+            return shard_for_pk(player_id)
+        return None
+    
+    def _route(self, model, hints):
+        if model._meta.app_label != 'game_app':
+            return None
+        
+        model_name = model._meta.model_name
+        if model_name in CATALOG:
+            return 'default'
+        
+        instance = hints.get('instance')
+        if instance is not None and (model_name in PLAYER_ROOTS or model_name in PLAYER_OWNED):
+            return self._alias_for_instance(instance)
+        return None
+    
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+    
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+    
+    def allow_relation(self, obj1, obj2, **hints):
+        #справочники есть на каждом шарде, связи с ними допустимы
+        if obj1._meta.app_label == 'game_app' and obj2._meta.app_label == 'game_app':
+            return True
+        return None
+    
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'game_app':
+            return True
+        return db == 'default'
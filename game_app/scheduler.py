@@ -0,0 +1,123 @@
+import heapq
+import logging
+import time
+from datetime import timedelta
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Boost
+from .sharding import group_by_shard, shard_aliases
+
+
+logger = logging.getLogger(__name__)
+
+class BoostExpiryScheduler:
+    #планировщик истечения бустов: куча (expires_at, шард, id) только по ожидающим бустам
+    
+    def __init__(self, batch_size=500, poll_overlap=timedelta(seconds=5)):
+        self.batch_size = batch_size
+        self.poll_overlap = poll_overlap
+        self.heap = []
+        self.pending = {}  #(шард, boost_id) -> expires_at, актуальные записи кучи
+        self.watermarks = {}
+        self.expired_total = 0
+    
+    def _active_boosts(self, alias):
+        return Boost.objects.using(alias).filter(is_active=True, expires_at__isnull=False)
+    
+    def _push(self, alias, boost_id, expires_at):
+        if self.pending.get((alias, boost_id)) == expires_at:
+            return False
+        
+        #при повторной активации старая запись в куче становится устаревшей
+        self.pending[(alias, boost_id)] = expires_at
+        heapq.heappush(self.heap, (expires_at, alias, boost_id))
+        return True
+    
+    def load(self):
+        #восстановление состояния после рестарта: все активные бусты из базы
+        self.heap = []
+        self.pending = {}
+        
+        for alias in shard_aliases():
+            for boost_id, expires_at in self._active_boosts(alias).values_list('id', 'expires_at').iterator():
+                self._push(alias, boost_id, expires_at)
+            self.watermarks[alias] = self._active_boosts(alias).aggregate(value=Max('used_at'))['value']
+        
+        return len(self.pending)
+    
+    def poll(self):
+        #новые активации по водяному знаку used_at с перекрытием на поздние коммиты
+        added = 0
+        for alias in shard_aliases():
+            watermark = self.watermarks.get(alias)
+            boosts = self._active_boosts(alias)
+            if watermark is not None:
+                boosts = boosts.filter(used_at__gte=watermark - self.poll_overlap)
+            
+            for boost_id, expires_at, used_at in boosts.values_list('id', 'expires_at', 'used_at'):
+                if self._push(alias, boost_id, expires_at):
+                    added += 1
+                if used_at and (watermark is None or used_at > watermark):
+                    watermark = used_at
+            
+            self.watermarks[alias] = watermark
+        
+        return added
+    
+    def _pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now and len(due) < self.batch_size:
+            expires_at, alias, boost_id = heapq.heappop(self.heap)
+            if self.pending.get((alias, boost_id)) != expires_at:
+                continue
+            del self.pending[(alias, boost_id)]
+            due.append((alias, boost_id))
+        return due
+    
+    def tick(self, now=None):
+        #один проход: подхватить новые активации и истечь все просроченные бусты
+        if now is None:
+            now = timezone.now()
+        
+        self.poll()
+        
+        expired = 0
+        while True:
+            due = self._pop_due(now)
+            if not due:
+                break
+            for alias, keys in group_by_shard(due, key=lambda item: item[0]).items():
+                boost_ids = [boost_id for _, boost_id in keys]
+                expired += len(Boost.expire_batch(boost_ids, now=now, using=alias))
+        
+        self.expired_total += expired
+        return expired
+    
+    def seconds_until_next(self, now=None):
+        if not self.heap:
+            return None
+        if now is None:
+            now = timezone.now()
+        return max((self.heap[0][0] - now).total_seconds(), 0.0)
+    
+    def run(self, poll_interval=1.0, should_stop=lambda: False):
+        #состояние должно быть загружено через load(); после ошибки куча могла разойтись с базой,
+        #поэтому следующий проход начинается с повторной загрузки
+        reload = False
+        while not should_stop():
+            try:
+                if reload:
+                    self.load()
+                    reload = False
+                self.tick()
+            except Exception:
+                logger.exception('Ошибка планировщика бустов, повтор через %s с', poll_interval)
+                reload = True
+                time.sleep(poll_interval)
+                continue
+            
+            #спим до следующего истечения, но не дольше интервала опроса
+            delay = self.seconds_until_next()
+            time.sleep(poll_interval if delay is None else min(delay, poll_interval))
@@ -0,0 +1,133 @@
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models import F
+
+
+SHARD_BITS = 10  #младшие биты pk игрока хранят номер шарда, до 1024 шардов
+SHARD_MASK = (1 << SHARD_BITS) - 1
+
+#таблицы игрока живут на его шарде, справочники копируются на все шарды
+PLAYER_ROOTS = {'player': 'username', 'playertask2': 'player_id'}
+PLAYER_OWNED = {'boost', 'playerboosthistory', 'playerlevel', 'playeraward', 'shardsequence'}
+CATALOG = ('boosttype', 'level', 'award', 'levelaward')
+
+
+def shard_aliases():
+    return list(getattr(settings, 'GAME_SHARDS', [])) or ['default']
+
+
+def is_sharded():
+    return bool(getattr(settings, 'GAME_SHARDS', []))
+
+
+def shard_index_for_key(key):
+    #стабильный хэш внешнего id, не зависит от PYTHONHASHSEED
+    return zlib.crc32(str(key).encode()) % len(shard_aliases())
+
+
+def shard_for_key(key):
+    return shard_aliases()[shard_index_for_key(key)]
+
+
+def shard_for_pk(pk):
+    if not is_sharded():
+        return 'default'
+    aliases = shard_aliases()
+    #чужой или выдуманный pk уходит на какой-то шард и там просто не найдется
+    return aliases[(int(pk) & SHARD_MASK) % len(aliases)]
+
+
+def group_by_shard(values, key=shard_for_pk):
+    #раскладка pk или внешних id по шардам
+    groups = defaultdict(list)
+    for value in values:
+        groups[key(value)].append(value)
+    return groups
+
+
+def next_sequence(alias, name, count=1):
+    #диапазон номеров из ShardSequence шарда
+    from .models import ShardSequence
+    
+    sequences = ShardSequence.objects.using(alias)
+    with transaction.atomic(using=alias):
+        if not sequences.filter(name=name).update(value=F('value') + count):
+            sequences.get_or_create(name=name)
+            sequences.filter(name=name).update(value=F('value') + count)
+        last = sequences.get(name=name).value
+    return range(last - count + 1, last + 1)
+
+
+def assign_pks(objs):
+    #pk = номер в шарде << SHARD_BITS | номер шарда; нужно и перед bulk_create
+    if not is_sharded():
+        return objs
+    
+    pending = defaultdict(list)
+    for obj in objs:
+        if obj.pk is None:
+            key = getattr(obj, PLAYER_ROOTS[obj._meta.model_name])
+            pending[(obj._meta.model_name, shard_index_for_key(key))].append(obj)
+    
+    for (model_name, index), group in pending.items():
+        alias = shard_aliases()[index]
+        for obj, number in zip(group, next_sequence(alias, model_name, len(group))):
+            obj.pk = number << SHARD_BITS | index
+    
+    return objs
+
+
+class ShardedQuerySet(models.QuerySet):
+    #create() без using() отдаёт роутеру сам объект, иначе строка ушла бы на default
+    
+    def create(self, **kwargs):
+        if self._db is not None or not is_sharded():
+            return super().create(**kwargs)
+        
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=router.db_for_write(self.model, instance=obj))
+        return obj
+
+
+def assign_pk_on_save(sender, instance, raw=False, **kwargs):
+    if instance.pk is None and not raw:
+        assign_pks([instance])
+
+
+def sync_catalog(models=None):
+    #копия справочников с default на каждый шард: upsert по id и удаление лишних
+    from django.apps import apps
+    
+    if not is_sharded():
+        return 0
+    
+    copied = 0
+    for model_name in CATALOG:
+        model = apps.get_model('game_app', model_name)
+        if models is not None and model not in models:
+            continue
+        
+        rows = list(model.objects.using('default').all())
+        fields = [field.attname for field in model._meta.concrete_fields if not field.primary_key]
+        ids = [row.pk for row in rows]
+        
+        for alias in shard_aliases():
+            with transaction.atomic(using=alias):
+                model.objects.using(alias).exclude(pk__in=ids).delete()
+                model.objects.using(alias).bulk_create(
+                    rows, update_conflicts=True, unique_fields=['id'], update_fields=fields
+                )
+            copied += len(rows)
+    
+    return copied
+
+
+def sync_catalog_on_change(sender, using=None, **kwargs):
+    #удаления на самих шардах при синхронизации сигнал тоже отправляют;
+    #копия после коммита: откат на default не должен оставить строки на шардах
+    if using == 'default' and is_sharded():
+        transaction.on_commit(lambda: sync_catalog(models=[sender]), using='default')
@@ -0,0 +1,15 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class GameTestRunner(DiscoverRunner):
+    #тесты идут без шардов при любом GAME_SHARD_COUNT, ShardingTest включает их через override_settings
+    
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.shards_override = override_settings(GAME_SHARDS=[], DATABASE_ROUTERS=[])
+        self.shards_override.enable()
+    
+    def teardown_test_environment(self, **kwargs):
+        self.shards_override.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,8 +1,38 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.utils import timezone
-from .models import Player, BoostType, Boost, PlayerBoostHistory
+from .models import (
+    Player, BoostType, Boost, PlayerBoostHistory, DailyLoginStats, CohortRetention,
+    PlayerTask2, Level, Award, PlayerLevel, LevelAward, PlayerAward, IdempotencyRecord,
+    GameService, GameJob
+)
+from . import analytics
+from .idempotency import idempotency_cache
+from . import jobs
+from .importer import CompletionImporter
+from .scheduler import BoostExpiryScheduler
+from . import profiling
+from .catalog import level_catalog
+from . import sharding
+from . import loadtest
+from .purge import count_inactive, purge_inactive_players
+from .exports import current_fingerprint, export_snapshots, make_token as make_export_token
+from .resolver import PlayerIdResolver, player_resolver
+from django.apps import apps as django_apps
+from django.db import IntegrityError, OperationalError, connection, transaction
+import gzip
+import importlib
 from django.core.exceptions import ValidationError
 from datetime import timedelta
+from django.core.management import CommandError, call_command
+import io
+import json
+import os
+import struct
+import tempfile
+from unittest import mock
+from pathlib import Path
+from django.contrib.auth.models import User
 
 
 class PlayerModelTest(TestCase):
@@ -47,23 +77,183 @@ class PlayerModelTest(TestCase):
         #второй вход
         player.record_login()
         
-        #первый вход не должен меняться
+        #первый вход не должен меняться, бонус за день уже получен
         self.assertEqual(player.first_login, first_login_time)
         self.assertEqual(player.login_count, 2)
-        self.assertEqual(player.daily_points, 20)
-        self.assertEqual(player.total_points, 20)
+        self.assertEqual(player.daily_points, 10)
+        self.assertEqual(player.total_points, 10)
+        
+        player.refresh_from_db()
+        self.assertEqual(player.first_login, first_login_time)
+        self.assertEqual(player.login_count, 2)
+        self.assertEqual(player.daily_logins, 2)
+        self.assertEqual(player.total_points, 10)
     
     def test_daily_points_accumulation(self):
         #тест накопления баллов ежедневных
         player = Player.objects.create(**self.player_data)
         
-        #несколько входов
+        #несколько входов за день
         for i in range(5):
             player.record_login()
         
         self.assertEqual(player.login_count, 5)
-        self.assertEqual(player.daily_points, 50)
-        self.assertEqual(player.total_points, 50)
+        self.assertEqual(player.daily_points, 10)
+        self.assertEqual(player.total_points, 10)
+        
+        #вход на следующий день снова дает бонус
+        Player.objects.filter(pk=player.pk).update(
+            last_login=timezone.now() - timedelta(days=1)
+        )
+        player.refresh_from_db()
+        player.record_login()
+        
+        player.refresh_from_db()
+        self.assertEqual(player.login_count, 6)
+        self.assertEqual(player.daily_logins, 1)
+        self.assertEqual(player.daily_points, 10)
+        self.assertEqual(player.total_points, 20)
+
+
+class DailyRolloverTest(TestCase):
+    
+    def setUp(self):
+        self.yesterday = timezone.localdate() - timedelta(days=1)
+        yesterday_noon = timezone.now() - timedelta(days=1)
+        
+        for i in range(5):
+            Player.objects.create(
+                username=f'player{i}',
+                email=f'player{i}@example.com',
+                last_login=yesterday_noon,
+                daily_logins=i + 1,
+                daily_points=10,
+                total_points=10,
+            )
+        
+        #игрок без входов вчера не попадает в агрегаты
+        Player.objects.create(username='idle', email='idle@example.com')
+    
+    def test_rollover_writes_stats_and_resets(self):
+        stats = Player.rollover_daily_points(day=self.yesterday, chunk_size=2)
+        
+        self.assertEqual(stats.date, self.yesterday)
+        self.assertEqual(stats.unique_players, 5)
+        self.assertEqual(stats.logins, 15)
+        self.assertEqual(stats.points, 50)
+        self.assertFalse(Player.objects.filter(daily_points__gt=0).exists())
+        self.assertEqual(Player.objects.filter(total_points=10).count(), 5)
+    
+    def test_rollover_changes_state_etag(self):
+        player = Player.objects.get(username='player0')
+        self.client.defaults['HTTP_X_GAME_EXPORT_TOKEN'] = make_export_token()
+        etag = self.client.get(f'/players/{player.id}/state/')['ETag']
+        
+        Player.rollover_daily_points(day=self.yesterday)
+        
+        response = self.client.get(f'/players/{player.id}/state/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['points']['daily'], 0)
+    
+    def test_login_before_rollover_keeps_yesterday(self):
+        #вход после полуночи до закрытия дня не теряет вчерашние счетчики
+        player = Player.objects.get(username='player2')
+        player.record_login()
+        
+        stats = Player.rollover_daily_points(day=self.yesterday)
+        
+        self.assertEqual(stats.unique_players, 5)
+        self.assertEqual(stats.logins, 15)
+        self.assertEqual(stats.points, 50)
+        player.refresh_from_db()
+        self.assertEqual((player.daily_logins, player.daily_points), (1, 10))
+        self.assertEqual((player.prev_logins, player.counters_day), (0, None))
+    
+    def test_first_login_of_day_is_single_update(self):
+        player = Player.objects.get(username='player2')
+        
+        with self.assertNumQueries(1):
+            player.record_login()
+        
+        player.refresh_from_db()
+        self.assertEqual((player.counters_day, player.prev_logins, player.prev_points), (self.yesterday, 3, 10))
+    
+    def test_missed_rollover_closes_each_day(self):
+        #запуск за позавчера пропущен: его счетчики попадают в свою строку статистики
+        before = self.yesterday - timedelta(days=1)
+        Player.objects.filter(username__in=['player0', 'player1']).update(
+            last_login=timezone.now() - timedelta(days=2)
+        )
+        
+        stats = Player.rollover_daily_points(day=self.yesterday)
+        
+        self.assertEqual((stats.unique_players, stats.logins, stats.points), (3, 12, 30))
+        missed = DailyLoginStats.objects.get(date=before)
+        self.assertEqual((missed.unique_players, missed.logins, missed.points), (2, 3, 20))
+        self.assertFalse(Player.objects.filter(daily_logins__gt=0).exists())
+    
+    def test_rollover_is_repeatable(self):
+        Player.rollover_daily_points(day=self.yesterday)
+        stats = Player.rollover_daily_points(day=self.yesterday)
+        
+        self.assertEqual(stats.unique_players, 5)
+        self.assertEqual(stats.points, 50)
+        self.assertEqual(DailyLoginStats.objects.count(), 1)
+
+
+class RetentionAnalyticsTest(TestCase):
+    
+    def setUp(self):
+        self.cohort_date = timezone.localdate() - timedelta(days=40)
+        first_login = timezone.now() - timedelta(days=40)
+        
+        #возвраты через 0, 1, 7 и 30 дней
+        for i, days in enumerate([0, 1, 7, 30]):
+            Player.objects.create(
+                username=f'cohort{i}',
+                email=f'cohort{i}@example.com',
+                first_login=first_login,
+                last_login=first_login + timedelta(days=days),
+            )
+    
+    def test_compute_cohort(self):
+        values = analytics.compute_cohort(self.cohort_date)
+        
+        self.assertEqual(values, {'size': 4, 'd1': 3, 'd7': 2, 'd30': 1})
+    
+    def test_incremental_refresh(self):
+        rows = analytics.refresh_retention()
+        self.assertEqual(len(rows), 1)
+        
+        #без новых входов пересчитывать нечего
+        self.assertEqual(analytics.refresh_retention(), [])
+        
+        Player.objects.filter(username='cohort0').update(last_login=timezone.now())
+        rows = analytics.refresh_retention()
+        
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].d30, 2)
+        
+        matrix = analytics.retention_matrix()
+        self.assertEqual(matrix[0]['d30'], 0.5)
+    
+    def test_young_cohort_has_no_rate(self):
+        #когорта трехдневной давности: d7 и d30 еще не наступили
+        cohort_date = timezone.localdate() - timedelta(days=3)
+        CohortRetention.objects.create(cohort_date=cohort_date, size=2, d1=1, computed_at=timezone.now())
+        
+        row = analytics.retention_matrix(start=cohort_date)[0]
+        
+        self.assertEqual((row['d1'], row['d7'], row['d30']), (0.5, None, None))
+    
+    def test_daily_active_counts(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        DailyLoginStats.objects.create(date=yesterday, unique_players=7)
+        Player.objects.get(username='cohort0').record_login()
+        
+        counts = analytics.daily_active_counts(yesterday, timezone.localdate())
+        
+        self.assertEqual(counts, {yesterday: 7, timezone.localdate(): 1})
 
 
 class BoostTypeModelTest(TestCase):
@@ -204,6 +394,111 @@ class BoostModelTest(TestCase):
         self.assertTrue(is_expired)
         self.assertFalse(boost.is_active)  #должен стать неактивным
     
+    def test_expiration_writes_history_once(self):
+        boost = Boost.objects.create(
+            player=self.player,
+            boost_type=self.boost_type,
+            quantity=1,
+            source='manual'
+        )
+        boost.activate()
+        Boost.objects.filter(pk=boost.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        boost.refresh_from_db()
+        
+        self.assertTrue(boost.is_expired())
+        self.assertTrue(boost.is_expired())
+        self.assertEqual(PlayerBoostHistory.objects.filter(player=self.player).count(), 1)
+    
+    def test_active_boost_mask(self):
+        boost = Boost.objects.create(player=self.player, boost_type=self.boost_type, quantity=2, source='manual')
+        later = Boost.objects.create(player=self.player, boost_type=self.boost_type, quantity=1, source='manual')
+        boost.activate()
+        self.boost_type.duration_minutes = 90
+        later.activate()
+        
+        self.player.refresh_from_db()
+        self.assertTrue(self.player.has_active_boost('speed'))
+        self.assertFalse(self.player.has_active_boost('damage'))
+        
+        #истечение одного буста не снимает бит, пока активен более поздний того же типа
+        Boost.expire_batch([boost.pk], now=boost.expires_at)
+        self.player.refresh_from_db()
+        self.assertTrue(self.player.has_active_boost('speed', now=boost.expires_at))
+        
+        Boost.expire_batch([later.pk], now=later.expires_at)
+        self.player.refresh_from_db()
+        self.assertEqual(self.player.active_boosts, 0)
+    
+    def test_short_expiry_vector_is_padded(self):
+        #строка, записанная до появления нового типа буста
+        expires = int((timezone.now() + timedelta(hours=1)).timestamp())
+        self.player.active_boosts = 1
+        self.player.boost_expiry = struct.pack('<1I', expires)
+        
+        self.assertEqual(list(self.player.boost_expiry_map()), ['speed'])
+        self.assertFalse(self.player.has_active_boost('coins'))
+    
+    def test_mask_backfill_skips_unknown_types(self):
+        backfill = importlib.import_module('game_app.migrations.0011_player_boost_mask').backfill_boost_mask
+        legacy = BoostType.objects.create(name='legacy')
+        for boost_type in (self.boost_type, legacy):
+            Boost.objects.create(
+                player=self.player, boost_type=boost_type, source='manual',
+                is_active=True, expires_at=timezone.now() + timedelta(hours=1),
+            )
+        
+        backfill(django_apps, mock.Mock(connection=connection))
+        
+        self.player.refresh_from_db()
+        self.assertEqual(self.player.active_boosts, 1 << BoostType.bit_for('speed'))
+    
+    def test_campaign_grant_is_idempotent(self):
+        for index in range(5):
+            Player.objects.create(username=f'campaign{index}', email=f'c{index}@example.com', last_login=timezone.now())
+        players = Player.objects.filter(username__startswith='campaign')
+        progress = []
+        
+        granted = Boost.grant_campaign_boosts('week-42', players, self.boost_type, quantity=2, chunk_size=2,
+                                              progress=lambda *args: progress.append(args))
+        
+        self.assertEqual(granted, 5)
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(Boost.objects.filter(campaign_id='week-42', quantity=2, source='campaign').count(), 5)
+        self.assertEqual(Player.objects.get(username='campaign0').revision, 1)
+        self.assertFalse(Boost.objects.filter(player=self.player).exists())
+        
+        Player.objects.create(username='campaign5', email='c5@example.com')
+        self.assertEqual(Boost.grant_campaign_boosts('week-42', players, self.boost_type), 1)
+        self.assertEqual(Player.objects.get(username='campaign0').revision, 1)
+    
+    def test_campaign_grant_over_multi_valued_filter(self):
+        #два буста игрока дают два совпадения по boosts__source
+        for _ in range(2):
+            Boost.objects.create(player=self.player, boost_type=self.boost_type, source='manual')
+        
+        out = io.StringIO()
+        call_command('grant_boosts', campaign='spring', boost_type='speed', filter=['boosts__source=manual'], stdout=out)
+        
+        self.assertEqual(Boost.objects.filter(player=self.player, campaign_id='spring').count(), 1)
+        self.assertIn('Выдано бустов: 1', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('grant_boosts', '--campaign=spring', '--boost-type=speed', '--active-days=7', '--since=2025-01-01')
+        #ключи очереди заданий акции не занимают
+        with self.assertRaises(CommandError):
+            call_command('grant_boosts', '--campaign=job:1', '--boost-type=speed')
+    
+    def test_lobby_load(self):
+        other = Player.objects.create(username='other', email='other@example.com')
+        boost = Boost.objects.create(player=self.player, boost_type=self.boost_type, source='manual')
+        boost.activate()
+        
+        with self.assertNumQueries(1):
+            lobby = Player.load_active_boosts([self.player.pk, other.pk])
+        
+        self.assertEqual(list(lobby[self.player.pk]), ['speed'])
+        self.assertEqual(lobby[other.pk], {})
+        self.assertEqual(Player.load_active_boosts([self.player.pk], now=boost.expires_at)[self.player.pk], {})
+    
     def test_award_boost_for_level(self):
         #начисление буста за прохождение уровня
         boost = Boost.award_boost_for_level(
@@ -234,6 +529,64 @@ class BoostModelTest(TestCase):
         self.assertIsNone(boost.level_earned)
 
 
+class BoostExpirySchedulerTest(TestCase):
+    
+    def setUp(self):
+        self.player = Player.objects.create(
+            username='test_player',
+            email='test@example.com'
+        )
+        self.boost_type = BoostType.objects.create(name='speed', duration_minutes=30)
+    
+    def make_active_boost(self, expires_in):
+        boost = Boost.award_boost_manually(self.player, self.boost_type)
+        boost.activate()
+        Boost.objects.filter(pk=boost.pk).update(expires_at=timezone.now() + expires_in)
+        return boost
+    
+    def test_tick_expires_due_boosts(self):
+        due = self.make_active_boost(timedelta(minutes=-1))
+        pending = self.make_active_boost(timedelta(minutes=10))
+        
+        scheduler = BoostExpiryScheduler(batch_size=1)
+        self.assertEqual(scheduler.load(), 2)
+        self.assertEqual(scheduler.tick(), 1)
+        
+        due.refresh_from_db()
+        pending.refresh_from_db()
+        self.assertFalse(due.is_active)
+        self.assertTrue(pending.is_active)
+        self.assertEqual(list(scheduler.pending), [('default', pending.pk)])
+        
+        history = PlayerBoostHistory.objects.get()
+        self.assertEqual(history.expired_at, due.expires_at)
+        self.assertEqual(history.activated_at, due.used_at)
+    
+    def test_poll_picks_up_new_activations(self):
+        scheduler = BoostExpiryScheduler()
+        self.assertEqual(scheduler.load(), 0)
+        
+        boost = self.make_active_boost(timedelta(minutes=-1))
+        
+        self.assertEqual(scheduler.tick(), 1)
+        self.assertEqual(scheduler.tick(), 0)
+        self.assertFalse(Boost.objects.get(pk=boost.pk).is_active)
+        self.assertEqual(PlayerBoostHistory.objects.count(), 1)
+    
+    def test_run_survives_errors_and_reloads(self):
+        scheduler = BoostExpiryScheduler()
+        scheduler.load()
+        boost = self.make_active_boost(timedelta(minutes=-1))
+        stops = iter([False, False, True])
+        
+        #первый проход падает на занятой базе, второй перечитывает бусты через load()
+        with mock.patch.object(scheduler, 'poll', side_effect=[OperationalError('database is locked'), 0]):
+            with self.assertLogs('game_app.scheduler', level='ERROR'):
+                scheduler.run(poll_interval=0, should_stop=lambda: next(stops))
+        
+        self.assertFalse(Boost.objects.get(pk=boost.pk).is_active)
+
+
 class PlayerBoostHistoryModelTest(TestCase):
     
     def setUp(self):
@@ -347,4 +700,870 @@ class IntegrationTest(TestCase):
         player2_boosts = Boost.objects.filter(player=player2)
         
         self.assertEqual(player1_boosts.count(), 1)
-        self.assertEqual(player2_boosts.count(), 1)
\ No newline at end of file
+        self.assertEqual(player2_boosts.count(), 1)
+
+
+class GameServiceTest(TestCase):
+    
+    def setUp(self):
+        self.player = PlayerTask2.objects.create(player_id='ext-1')
+        self.level = Level.objects.create(title='Level 1', order=1)
+        self.award = Award.objects.create(title='Gold')
+        LevelAward.objects.create(level=self.level, award=self.award)
+        idempotency_cache.cache.clear()
+    
+    def test_assign_award_for_level_completion(self):
+        result = GameService.assign_award_for_level_completion(self.player.id, self.level.id)
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['award'], ['Gold'])
+        
+        #повторное прохождение награду не дублирует
+        result = GameService.assign_award_for_level_completion(self.player.id, self.level.id)
+        self.assertEqual(result['award'], [])
+        self.assertEqual(PlayerAward.objects.count(), 1)
+    
+    def test_idempotent_retry_returns_first_response(self):
+        first = GameService.assign_award_for_level_completion(
+            self.player.id, self.level.id, idempotency_key='retry-1'
+        )
+        
+        #повтор из кэша не обращается к базе
+        with self.assertNumQueries(0):
+            retry = GameService.assign_award_for_level_completion(
+                self.player.id, self.level.id, idempotency_key='retry-1'
+            )
+        self.assertEqual(retry, first)
+        self.assertEqual(retry['award'], ['Gold'])
+        
+        #после очистки кэша ответ берется из таблицы
+        idempotency_cache.cache.clear()
+        with self.assertNumQueries(1):
+            retry = GameService.assign_award_for_level_completion(
+                self.player.id, self.level.id, idempotency_key='retry-1'
+            )
+        self.assertEqual(retry, first)
+        self.assertEqual(IdempotencyRecord.objects.count(), 1)
+    
+    def test_expired_key_is_reused(self):
+        GameService.assign_award_for_level_completion(self.player.id, self.level.id, idempotency_key='reused')
+        IdempotencyRecord.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        idempotency_cache.cache.clear()
+        
+        other = Level.objects.create(title='Level 2', order=2)
+        result = GameService.assign_award_for_level_completion(self.player.id, other.id, idempotency_key='reused')
+        
+        self.assertEqual(result['level'], 'Level 2')
+        self.assertEqual(IdempotencyRecord.objects.get().response['level'], 'Level 2')
+    
+    def test_key_is_stored_hashed(self):
+        key = 'k' * 1000
+        GameService.assign_award_for_level_completion(self.player.id, self.level.id, idempotency_key=key)
+        
+        self.assertEqual(len(IdempotencyRecord.objects.get().key), 64)
+        idempotency_cache.cache.clear()
+        self.assertEqual(idempotency_cache.get(f'assign_award:{key}')['level'], 'Level 1')
+    
+    def test_idempotency_purge_and_stats(self):
+        IdempotencyRecord.objects.create(
+            key='old', response={}, expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        
+        self.assertEqual(idempotency_cache.purge(), 1)
+        
+        stats = idempotency_cache.stats()
+        self.assertIn('hit_rate', stats)
+        self.assertEqual(stats['cache_alias'], 'idempotency')
+
+
+class JobQueueTest(TestCase):
+    
+    def setUp(self):
+        self.player = PlayerTask2.objects.create(player_id='ext-1')
+        self.level = Level.objects.create(title='Level 1', order=1)
+        LevelAward.objects.create(level=self.level, award=Award.objects.create(title='Gold'))
+        self.boost_player = Player.objects.create(username='worker', email='worker@example.com')
+        self.boost_type = BoostType.objects.create(name='speed')
+        idempotency_cache.cache.clear()
+    
+    def test_worker_runs_jobs(self):
+        jobs.enqueue_level_completion(self.player.id, self.level.id)
+        jobs.enqueue_boost_grant(self.boost_player.id, self.boost_type.id, quantity=2)
+        
+        worker = jobs.JobWorker(batch_size=10)
+        self.assertEqual(worker.run_once(), 2)
+        self.assertEqual(worker.run_once(), 0)
+        
+        self.assertEqual(PlayerAward.objects.filter(player=self.player).count(), 1)
+        self.assertEqual(Boost.objects.get(player=self.boost_player).quantity, 2)
+        self.assertEqual(jobs.queue_stats()['depth']['done'], 2)
+    
+    def test_failed_job_is_retried_with_backoff(self):
+        job = jobs.enqueue_level_completion(self.player.id + 100, self.level.id)
+        
+        worker = jobs.JobWorker(max_attempts=2)
+        worker.run_once()
+        
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(worker.run_once(), 0)
+        
+        GameJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        worker.run_once()
+        
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.last_error, 'Игрок не найден')
+
+
+    def test_requeued_grant_is_not_duplicated(self):
+        job = jobs.enqueue_boost_grant(self.boost_player.id, self.boost_type.id, quantity=2)
+        slow = jobs.JobWorker(batch_size=10)
+        claimed = slow.claim()
+        
+        #первый воркер завис дольше таймаута, задание забирает второй
+        GameJob.objects.filter(pk=job.pk).update(claimed_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.JobWorker(batch_size=10).run_once(), 1)
+        
+        #поздний первый воркер не начисляет буст повторно и не трогает статус
+        GameJob.objects.filter(pk=job.pk).update(status='failed')
+        self.assertEqual(slow._run_boost_grants(claimed), {})
+        slow._finish(claimed, {})
+        
+        self.assertEqual(Boost.objects.filter(player=self.boost_player).count(), 1)
+        self.assertEqual(GameJob.objects.get(pk=job.pk).status, 'failed')
+    
+    def test_stale_job_fails_after_max_attempts(self):
+        job = jobs.enqueue_level_completion(self.player.id, self.level.id)
+        GameJob.objects.filter(pk=job.pk).update(
+            status='running', attempts=5, claimed_at=timezone.now() - timedelta(minutes=10)
+        )
+        
+        self.assertEqual(jobs.requeue_stale(max_attempts=5), 0)
+        self.assertEqual(GameJob.objects.get(pk=job.pk).status, 'failed')
+    
+    def test_run_survives_locked_database(self):
+        jobs.enqueue_boost_grant(self.boost_player.id, self.boost_type.id)
+        worker = jobs.JobWorker(batch_size=10)
+        stops = iter([False, False, True])
+        
+        run_once = worker.run_once
+        failures = [OperationalError('database is locked')]
+        
+        def flaky_run_once():
+            #первый проход падает на занятой базе, воркер продолжает работу
+            if failures:
+                raise failures.pop()
+            return run_once()
+        
+        with mock.patch.object(worker, 'run_once', side_effect=flaky_run_once), mock.patch.object(jobs.time, 'sleep'):
+            with self.assertLogs('game_app.jobs', level='ERROR'):
+                worker.run(poll_interval=0, should_stop=lambda: next(stops))
+        
+        self.assertEqual(Boost.objects.filter(player=self.boost_player).count(), 1)
+
+
+class CompletionImportTest(TestCase):
+    
+    def setUp(self):
+        player_resolver.invalidate()
+        self.player = PlayerTask2.objects.create(player_id='ext-1')
+        self.other = PlayerTask2.objects.create(player_id='ext-2')
+        self.level = Level.objects.create(title='Level 1', order=1)
+        LevelAward.objects.create(level=self.level, award=Award.objects.create(title='Gold'))
+        
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+    
+    def write_file(self, name, lines):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as target:
+            target.write('\n'.join(lines) + '\n')
+        return path
+    
+    def test_jsonl_import(self):
+        path = self.write_file('completions.jsonl', [
+            json.dumps({'player_id': 'ext-1', 'level_id': self.level.id}),
+            json.dumps({'player_id': 'ext-1', 'level_id': self.level.id}),
+            json.dumps({'player_id': 'ext-2', 'level_id': self.level.id, 'completed': '2025-01-02'}),
+            json.dumps({'player_id': 'unknown', 'level_id': self.level.id}),
+            'not json',
+        ])
+        
+        importer = CompletionImporter(path, chunk_size=2)
+        stats = importer.run()
+        
+        self.assertEqual(stats['rows'], 5)
+        self.assertEqual(stats['invalid'], 1)
+        self.assertEqual(stats['unresolved'], 1)
+        self.assertTrue(any('player_id=unknown' in error for error in importer.errors))
+        self.assertEqual(stats['offset'], os.path.getsize(path))
+        self.assertEqual(PlayerAward.objects.count(), 2)
+        self.assertEqual(
+            PlayerLevel.objects.get(player=self.other).completed.isoformat(), '2025-01-02'
+        )
+    
+    def test_invalid_utf8_line_is_counted(self):
+        path = self.write_file('completions.jsonl', [json.dumps({'player_id': 'ext-1', 'level_id': self.level.id})])
+        with open(path, 'ab') as target:
+            target.write(b'{"player_id": "\xff"}\n')
+            target.write(json.dumps({'player_id': 'ext-2', 'level_id': self.level.id}).encode() + b'\n')
+        
+        stats = CompletionImporter(path).run()
+        
+        self.assertEqual(stats['invalid'], 1)
+        self.assertEqual(PlayerAward.objects.count(), 2)
+    
+    def test_csv_import_resumes_from_checkpoint(self):
+        path = self.write_file('completions.csv', [
+            'player_id,level_id',
+            f'ext-1,{self.level.id}',
+            f'ext-2,{self.level.id}',
+        ])
+        
+        CompletionImporter(path, chunk_size=1).save_checkpoint(len(f'player_id,level_id\next-1,{self.level.id}\n'))
+        stats = CompletionImporter(path).run(resume=True)
+        
+        self.assertEqual(stats['rows'], 1)
+        self.assertEqual(list(PlayerLevel.objects.values_list('player__player_id', flat=True)), ['ext-2'])
+        self.assertTrue(PlayerLevel.objects.get().is_completed)
+
+
+class ProfilingTest(TestCase):
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output_dir = directory.name
+        
+        settings_override = override_settings(GAME_PROFILING={'OUTPUT_DIR': self.output_dir})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        profiling.rate_limiter.started = []
+    
+    def test_session_records_spans_and_sql(self):
+        player = Player.objects.create(username='profiled', email='profiled@example.com')
+        
+        with profiling.ProfileSession('record login') as session:
+            player.record_login()
+        
+        self.assertEqual(session.spans[0]['label'], 'Player.record_login')
+        self.assertEqual(session.spans[0]['queries'], 1)
+        self.assertEqual(session.queries[0]['span'], 'Player.record_login')
+        for path in session.paths.values():
+            self.assertTrue(os.path.exists(path))
+        
+        with open(session.paths['collapsed']) as source:
+            self.assertIn('record_login', source.read())
+    
+    def test_middleware_requires_signed_token(self):
+        response = self.client.get('/', HTTP_X_GAME_PROFILE='forged')
+        self.assertNotIn('X-Game-Profile-Id', response)
+        
+        response = self.client.get('/', HTTP_X_GAME_PROFILE=profiling.make_token())
+        self.assertIn('X-Game-Profile-Id', response)
+    
+    def test_rate_limit(self):
+        with override_settings(GAME_PROFILING={'OUTPUT_DIR': self.output_dir, 'MAX_PER_MINUTE': 1}):
+            self.assertTrue(profiling.rate_limiter.allow())
+            self.assertFalse(profiling.rate_limiter.allow())
+
+
+class PlayerStateViewTest(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        self.player = Player.objects.create(username='ext-1', email='state@example.com')
+        self.boost_type = BoostType.objects.create(name='speed', multiplier=2.0)
+        self.url = f'/players/{self.player.id}/state/'
+        self.client.defaults['HTTP_X_GAME_EXPORT_TOKEN'] = make_export_token()
+        
+        level = Level.objects.create(title='Level 1', order=1)
+        LevelAward.objects.create(level=level, award=Award.objects.create(title='Gold'))
+        GameService.assign_award_for_level_completion(
+            PlayerTask2.objects.create(player_id='ext-1').id, level.id
+        )
+    
+    def test_snapshot_and_conditional_get(self):
+        Boost.award_boost_manually(self.player, self.boost_type, quantity=2).activate()
+        
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url)
+        
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['active_boosts'][0]['type'], 'speed')
+        self.assertEqual(data['inventory'][0]['quantity'], 1)
+        self.assertEqual(data['levels'][0]['title'], 'Level 1')
+        self.assertEqual(data['awards'][0]['title'], 'Gold')
+        
+        #304 только по версии игрока
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        
+        #без If-None-Match снимок берется из кэша
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).json(), data)
+    
+    def test_revision_bumps_invalidate_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        
+        self.player.record_login()
+        
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['login_count'], 1)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_unknown_player(self):
+        self.assertEqual(self.client.get('/players/999/state/').status_code, 404)
+    
+    def test_requires_staff_or_token(self):
+        del self.client.defaults['HTTP_X_GAME_EXPORT_TOKEN']
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get(self.url, headers={'X-Game-Export-Token': 'forged'}).status_code, 403)
+        
+        self.client.force_login(User.objects.create_user('support', is_staff=True))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class LevelScoreTest(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        self.level = Level.objects.create(title='Level 1', order=1)
+        self.players = [PlayerTask2.objects.create(player_id=f'ext-{i}') for i in range(4)]
+    
+    def test_submit_score_keeps_best(self):
+        player = self.players[0]
+        
+        self.assertTrue(GameService.submit_score(player.id, self.level.id, 50)['improved'])
+        self.assertTrue(GameService.submit_score(player.id, self.level.id, 70)['improved'])
+        
+        result = GameService.submit_score(player.id, self.level.id, 60)
+        self.assertFalse(result['improved'])
+        self.assertEqual(result['best'], 70)
+        self.assertEqual(PlayerLevel.objects.get(player=player).score, 70)
+        
+        self.assertFalse(GameService.submit_score(player.id, 999, 10)['success'])
+    
+    def test_leaderboard_is_versioned_in_cache(self):
+        for player, score in zip(self.players[:3], [30, 10, 20]):
+            GameService.submit_score(player.id, self.level.id, score)
+        
+        leaderboard = GameService.get_level_leaderboard(self.level.id)
+        self.assertEqual([entry['player'] for entry in leaderboard], ['ext-0', 'ext-2', 'ext-1'])
+        with self.assertNumQueries(0):
+            GameService.get_level_leaderboard(self.level.id)
+        
+        #новый рекорд меняет версию, список пересобирается при следующем чтении
+        GameService.submit_score(self.players[1].id, self.level.id, 40)
+        
+        with self.assertNumQueries(1):
+            leaderboard = GameService.get_level_leaderboard(self.level.id, limit=2)
+        self.assertEqual(leaderboard, [
+            {'rank': 1, 'player': 'ext-1', 'score': 40},
+            {'rank': 2, 'player': 'ext-0', 'score': 30},
+        ])
+        
+        percentile = GameService.get_player_percentile(self.players[2].id, self.level.id)
+        self.assertEqual(percentile['rank'], 3)
+        self.assertAlmostEqual(percentile['percentile'], 0.0)
+    
+    def test_batch_submission(self):
+        GameService.submit_score(self.players[0].id, self.level.id, 50)
+        GameService.get_level_leaderboard(self.level.id)
+        
+        result = GameService.submit_scores([
+            (self.players[0].id, self.level.id, 40),
+            (self.players[1].id, self.level.id, 60),
+            (self.players[1].id, self.level.id, 65),
+            (self.players[2].id, 999, 10),
+        ])
+        
+        self.assertEqual(result['improved'], [(self.players[1].id, self.level.id)])
+        self.assertEqual(result['rejected'], 1)
+        self.assertEqual(PlayerLevel.objects.get(player=self.players[0]).score, 50)
+        self.assertEqual(PlayerLevel.objects.get(player=self.players[1]).score, 65)
+        self.assertEqual(GameService.get_level_leaderboard(self.level.id)[0]['player'], 'ext-1')
+    
+    @mock.patch.object(GameService, 'LEADERBOARD_SIZE', 2)
+    def test_score_below_full_top_keeps_cache(self):
+        for player, score in zip(self.players[:2], [30, 20]):
+            GameService.submit_score(player.id, self.level.id, score)
+        GameService.get_level_leaderboard(self.level.id)
+        
+        #список полон, 10 в него не входит - версия прежняя
+        GameService.submit_score(self.players[2].id, self.level.id, 10)
+        with self.assertNumQueries(0):
+            GameService.get_level_leaderboard(self.level.id)
+        
+        GameService.submit_score(self.players[3].id, self.level.id, 25)
+        leaderboard = GameService.get_level_leaderboard(self.level.id)
+        self.assertEqual([entry['score'] for entry in leaderboard], [30, 25])
+    
+    def test_negative_score_is_rejected(self):
+        result = GameService.submit_score(self.players[0].id, self.level.id, -1)
+        self.assertEqual(result, {'success': False, 'error': 'Отрицательный счет'})
+        
+        result = GameService.submit_scores([(self.players[0].id, self.level.id, 5), (self.players[1].id, self.level.id, -5)])
+        self.assertFalse(result['success'])
+        self.assertFalse(PlayerLevel.objects.exists())
+
+
+class ProgressionMapTest(TestCase):
+    
+    def setUp(self):
+        level_catalog.invalidate()
+        self.levels = [Level.objects.create(title=f'Level {i}', order=i) for i in range(1, 4)]
+        self.gold = Award.objects.create(title='Gold')
+        LevelAward.objects.create(level=self.levels[0], award=self.gold)
+        self.player = PlayerTask2.objects.create(player_id='ext-1')
+        self.other = PlayerTask2.objects.create(player_id='ext-2')
+        GameService.assign_award_for_level_completion(self.player.id, self.levels[0].id)
+    
+    def test_progression_map(self):
+        level_catalog.levels()
+        
+        with self.assertNumQueries(3):
+            progression = GameService.get_progression_map(self.player.id)
+        
+        self.assertEqual(progression['completed'], 1)
+        self.assertEqual(progression['next_level'], self.levels[1].id)
+        self.assertEqual([entry['order'] for entry in progression['levels']], [1, 2, 3])
+        self.assertEqual(progression['levels'][0]['awards_received'], ['Gold'])
+    
+    def test_catalog_is_reset_after_commit(self):
+        level_catalog.levels()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Level.objects.create(title='Level 4', order=4)
+            #до коммита в кэше остается прежний список
+            self.assertEqual(len(level_catalog.levels()), 3)
+        
+        self.assertEqual(len(level_catalog.levels()), 4)
+    
+    def test_pending_awards_after_catalog_change(self):
+        LevelAward.objects.create(level=self.levels[0], award=Award.objects.create(title='Silver'))
+        
+        progression = GameService.get_progression_map(self.player.id)
+        self.assertEqual(progression['levels'][0]['awards_pending'], ['Silver'])
+    
+    def test_bulk_maps(self):
+        maps = GameService.get_progression_maps([self.player.id, self.other.id])
+        
+        self.assertEqual(maps[self.player.id]['completed'], 1)
+        self.assertEqual(maps[self.other.id]['completed'], 0)
+        self.assertEqual(maps[self.other.id]['next_level'], self.levels[0].id)
+    
+    def test_unknown_player_has_no_map(self):
+        missing = self.other.id + 100
+        
+        self.assertNotIn(missing, GameService.get_progression_maps([self.player.id, missing]))
+        self.assertEqual(
+            GameService.get_progression_map(missing),
+            {'success': False, 'error': 'Игрок не найден', 'code': 'player_not_found'},
+        )
+
+
+class ShardKeyTest(TestCase):
+    
+    @override_settings(GAME_SHARDS=['shard0', 'shard1', 'shard2'])
+    def test_key_and_pk_map_to_same_shard(self):
+        alias = sharding.shard_for_key('ext-1')
+        index = sharding.shard_aliases().index(alias)
+        
+        self.assertEqual(sharding.shard_for_key('ext-1'), alias)
+        self.assertEqual(sharding.shard_for_pk(42 << sharding.SHARD_BITS | index), alias)
+    
+    @override_settings(GAME_SHARDS=[])
+    def test_unsharded_is_default(self):
+        self.assertEqual(sharding.shard_for_pk(12345), 'default')
+        self.assertEqual(sharding.shard_for_key('ext-1'), 'default')
+
+
+@override_settings(GAME_SHARDS=['shard0', 'shard1'], DATABASE_ROUTERS=['game_app.routers.PlayerShardRouter'])
+class ShardingTest(TestCase):
+    #алиасы shard0 и shard1 объявлены в настройках всегда, GameTestRunner выключает шарды для остальных тестов
+    databases = '__all__'
+    
+    def setUp(self):
+        level_catalog.invalidate()
+        player_resolver.invalidate()
+        cache.clear()
+        
+        #справочники копируются на шарды после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            self.level = Level.objects.create(title='Level 1', order=1)
+            LevelAward.objects.create(level=self.level, award=Award.objects.create(title='Gold'))
+            self.boost_type = BoostType.objects.create(name='speed')
+        self.players = [PlayerTask2.objects.create(player_id=f'ext-{i}') for i in range(6)]
+    
+    def test_players_live_on_their_shard(self):
+        for player in self.players:
+            alias = sharding.shard_for_key(player.player_id)
+            self.assertEqual(sharding.shard_for_pk(player.pk), alias)
+            self.assertTrue(PlayerTask2.objects.using(alias).filter(pk=player.pk).exists())
+        
+        self.assertEqual({sharding.shard_for_pk(player.pk) for player in self.players}, {'shard0', 'shard1'})
+    
+    def test_catalog_replicated(self):
+        for alias in sharding.shard_aliases():
+            self.assertTrue(LevelAward.objects.using(alias).filter(level_id=self.level.id).exists())
+    
+    def test_rolled_back_catalog_change_is_not_replicated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    Level.objects.create(title='Level 2', order=2)
+                    BoostType.objects.create(name='speed')
+        
+        for alias in sharding.shard_aliases():
+            self.assertFalse(Level.objects.using(alias).filter(title='Level 2').exists())
+    
+    def test_award_on_player_shard(self):
+        player = self.players[0]
+        alias = sharding.shard_for_pk(player.pk)
+        
+        GameService.assign_award_for_level_completion(player.pk, self.level.id)
+        
+        self.assertEqual(PlayerAward.objects.using(alias).filter(player_id=player.pk).count(), 1)
+        self.assertTrue(PlayerLevel.objects.using(alias).get(player_id=player.pk).completed)
+    
+    def test_scores_and_leaderboard_across_shards(self):
+        result = GameService.submit_scores_by_external_id([
+            (player.player_id, self.level.id, 10 * (index + 1)) for index, player in enumerate(self.players)
+        ])
+        
+        self.assertEqual(len(result['improved']), 6)
+        leaderboard = GameService.get_level_leaderboard(self.level.id, limit=3)
+        self.assertEqual([entry['player'] for entry in leaderboard], ['ext-5', 'ext-4', 'ext-3'])
+        self.assertEqual(GameService.get_player_percentile(self.players[0].pk, self.level.id)['rank'], 6)
+    
+    def test_export_rows_from_all_shards(self):
+        for player in self.players:
+            GameService.assign_award_for_level_completion(player.pk, self.level.id)
+        
+        rows = list(GameService.iter_player_level_rows(chunk_size=2))
+        
+        self.assertEqual(sorted(row[0] for row in rows), [f'ext-{i}' for i in range(6)])
+        self.assertEqual({row[3] for row in rows}, {'Gold'})
+    
+    def test_purge_and_campaign_grant_on_shards(self):
+        old = timezone.now() - timedelta(days=400)
+        for index in range(6):
+            Player.objects.create(
+                username=f'user-{index}', email=f'user-{index}@example.com',
+                last_login=old if index % 2 else timezone.now(),
+            )
+        
+        players = Player.objects.all()
+        self.assertEqual(Boost.grant_campaign_boosts('spring', players, self.boost_type), 6)
+        self.assertEqual(Boost.grant_campaign_boosts('spring', players, self.boost_type), 0)
+        
+        totals = purge_inactive_players(days=365)
+        
+        self.assertEqual(totals['players'], 3)
+        self.assertEqual(totals['boosts'], 3)
+        remaining = sorted(
+            name for alias in sharding.shard_aliases()
+            for name in Player.objects.using(alias).values_list('username', flat=True)
+        )
+        self.assertEqual(remaining, ['user-0', 'user-2', 'user-4'])
+    
+    def test_admin_reads_player_shards(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        
+        for alias in sharding.shard_aliases():
+            response = self.client.get('/admin/game_app/playertask2/', {'shard': alias})
+            self.assertEqual(response.status_code, 200)
+            expected = [player.player_id for player in self.players if sharding.shard_for_pk(player.pk) == alias]
+            self.assertEqual(sorted(str(row) for row in response.context['cl'].result_list), sorted(expected))
+        
+        player = next(player for player in self.players if sharding.shard_for_pk(player.pk) == 'shard1')
+        response = self.client.get(f'/admin/game_app/playertask2/{player.pk}/change/')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'])
+class LoadTestHarnessTest(TestCase):
+    
+    def test_parse_mix(self):
+        self.assertEqual(loadtest.parse_mix('login=3,state'), {'login': 3.0, 'state': 1.0})
+        self.assertEqual(loadtest.parse_mix(''), loadtest.DEFAULT_MIX)
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('teleport=1')
+    
+    def test_short_run_report(self):
+        fixtures = loadtest.prepare_fixtures(5, levels=2)
+        self.assertEqual(loadtest.prepare_fixtures(5, levels=2), fixtures)
+        self.assertEqual(list(BoostType.objects.values_list('name', flat=True)), ['load-boost'])
+        
+        mix = loadtest.parse_mix('login=1,activate_boost=1,complete_level=1,state=1')
+        result = loadtest.Simulation(fixtures, mix, seed=1).run(duration=0.3, interval=0.1)
+        report = loadtest.summarize([result], interval=0.1)
+        
+        self.assertGreater(report['totals']['operations'], 0)
+        self.assertEqual(report['totals']['errors'], 0)
+        self.assertLessEqual(report['totals']['p50_ms'], report['totals']['p99_ms'])
+        self.assertTrue(report['timeline'])
+        self.assertTrue(Player.objects.filter(username='load-0', login_count__gt=0).exists())
+        
+        loadtest.cleanup_fixtures()
+        self.assertFalse(PlayerTask2.objects.filter(player_id__startswith=loadtest.PREFIX).exists())
+        self.assertFalse(BoostType.objects.exists())
+
+
+class PurgeInactivePlayersTest(TestCase):
+    
+    def setUp(self):
+        boost_type = BoostType.objects.create(name='speed')
+        level = Level.objects.create(title='Level 1', order=1)
+        award = Award.objects.create(title='Gold')
+        old = timezone.now() - timedelta(days=400)
+        
+        for name, last_login in (('dormant', old), ('active', timezone.now())):
+            player = Player.objects.create(username=name, email=f'{name}@example.com', last_login=last_login)
+            Boost.objects.create(player=player, boost_type=boost_type, source='manual')
+            PlayerBoostHistory.objects.create(
+                player=player, boost_type=boost_type, activated_at=old, expired_at=old
+            )
+            task = PlayerTask2.objects.create(player_id=name)
+            PlayerLevel.objects.create(player=task, level=level, score=10)
+            PlayerAward.objects.create(player=task, award=award, level=level)
+    
+    def test_dry_run_counts(self):
+        counts = count_inactive(timezone.now() - timedelta(days=365))
+        
+        self.assertEqual(counts['players'], 1)
+        self.assertEqual(counts['boosts'], 1)
+        self.assertEqual((counts['tasks'], counts['levels'], counts['awards']), (1, 1, 1))
+        self.assertTrue(Player.objects.filter(username='dormant').exists())
+    
+    def test_purge_removes_dependents(self):
+        progress = []
+        totals = purge_inactive_players(days=365, chunk_size=1, progress=lambda *args: progress.append(args))
+        
+        self.assertEqual(totals['players'], 1)
+        self.assertEqual(totals['boost_history'], 1)
+        self.assertEqual(len(progress), 1)
+        self.assertEqual(list(Player.objects.values_list('username', flat=True)), ['active'])
+        self.assertEqual(Boost.objects.count(), 1)
+        self.assertEqual(PlayerBoostHistory.objects.count(), 1)
+        
+        #прогресс уровней удаляется по username игрока
+        self.assertEqual((totals['tasks'], totals['levels'], totals['awards']), (1, 1, 1))
+        self.assertEqual(list(PlayerTask2.objects.values_list('player_id', flat=True)), ['active'])
+        self.assertEqual(PlayerLevel.objects.count(), 1)
+        self.assertEqual(PlayerAward.objects.count(), 1)
+    
+    def test_purge_drops_leaderboard(self):
+        level = Level.objects.get()
+        self.assertEqual(len(GameService.get_level_leaderboard(level.id)), 2)
+        
+        purge_inactive_players(days=365)
+        
+        self.assertEqual([entry['player'] for entry in GameService.get_level_leaderboard(level.id)], ['active'])
+
+
+class ExportSnapshotTest(TestCase):
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        
+        self.output_dir = Path(directory.name)
+        settings_override = override_settings(GAME_EXPORTS={
+            'OUTPUT_DIR': directory.name, 'MAX_FILES': 2, 'FINGERPRINT_TTL': 0,
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        
+        self.levels = [Level.objects.create(title=f'Level {i}', order=i) for i in range(1, 3)]
+        self.gold = Award.objects.create(title='Gold')
+        self.silver = Award.objects.create(title='Silver')
+        self.player = PlayerTask2.objects.create(player_id='ext-1')
+        PlayerLevel.objects.create(player=self.player, level=self.levels[0], is_completed=True)
+        PlayerLevel.objects.create(player=self.player, level=self.levels[1])
+        for award in (self.gold, self.silver):
+            PlayerAward.objects.create(player=self.player, award=award, level=self.levels[0])
+    
+    def read_snapshot(self, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as snapshot:
+            return snapshot.read()
+    
+    def build(self):
+        fingerprint, snapshot = export_snapshots.open_snapshot()
+        snapshot.close()
+        return fingerprint, Path(snapshot.name)
+    
+    def test_csv_rows_without_per_row_queries(self):
+        with self.assertNumQueries(2):
+            content = GameService.export_player_level_data_to_csv().content.decode()
+        
+        self.assertEqual(content.splitlines(), [
+            'Player ID,Level Title,Is Completed,Received Award',
+            'ext-1,Level 1,Да,Gold',
+            'ext-1,Level 1,Да,Silver',
+            'ext-1,Level 2,Нет,Нет награды',
+        ])
+    
+    def test_snapshot_reused_until_data_changes(self):
+        fingerprint, path = self.build()
+        mtime = path.stat().st_mtime_ns
+        
+        self.assertEqual(self.build(), (fingerprint, path))
+        self.assertEqual(path.stat().st_mtime_ns, mtime)
+        self.assertIn('ext-1,Level 2,Нет,Нет награды', self.read_snapshot(path))
+        
+        PlayerLevel.objects.filter(level=self.levels[1]).update(is_completed=True)
+        new_fingerprint, new_path = self.build()
+        
+        self.assertNotEqual(new_fingerprint, fingerprint)
+        self.assertIn('ext-1,Level 2,Да,Нет награды', self.read_snapshot(new_path))
+    
+    def test_eviction_keeps_newest(self):
+        paths = []
+        for index in range(3):
+            PlayerTask2.objects.create(player_id=f'extra-{index}')
+            paths.append(self.build()[1])
+        
+        self.assertEqual(export_snapshots.snapshots(), [paths[2], paths[1]])
+        self.assertFalse(paths[0].exists())
+    
+    def test_open_snapshot_survives_eviction(self):
+        fingerprint, snapshot = export_snapshots.open_snapshot()
+        Path(snapshot.name).unlink()
+        
+        with snapshot, gzip.open(snapshot, 'rt', encoding='utf-8') as content:
+            self.assertIn('ext-1,Level 1,Да,Gold', content.read())
+    
+    def test_fingerprint_is_cached(self):
+        with override_settings(GAME_EXPORTS={'OUTPUT_DIR': self.output_dir, 'FINGERPRINT_TTL': 60}):
+            fingerprint = current_fingerprint()
+            with self.assertNumQueries(0):
+                self.assertEqual(current_fingerprint(), fingerprint)
+    
+    def test_download_requires_staff_or_token(self):
+        url = '/exports/player-levels.csv.gz'
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={'X-Game-Export-Token': 'forged'}).status_code, 403)
+        
+        response = self.client.get(url, headers={'X-Game-Export-Token': make_export_token()})
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        
+        self.client.force_login(User.objects.create_user('analyst', is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response.close()
+    
+    def test_not_modified_without_building(self):
+        etag = f'"{current_fingerprint()}"'
+        self.client.force_login(User.objects.create_user('analyst', is_staff=True))
+        
+        self.assertEqual(self.client.get('/exports/player-levels.csv.gz', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(export_snapshots.snapshots(), [])
+    
+    def test_download_with_range(self):
+        url = '/exports/player-levels.csv.gz'
+        self.client.force_login(User.objects.create_user('analyst', is_staff=True))
+        response = self.client.get(url)
+        full = b''.join(response.streaming_content)
+        response.close()
+        etag = response['ETag']
+        
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ext-1,Level 1,Да,Gold', gzip.decompress(full).decode())
+        
+        partial = self.client.get(url, HTTP_RANGE='bytes=10-', HTTP_IF_RANGE=etag)
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f'bytes 10-{len(full) - 1}/{len(full)}')
+        self.assertEqual(b''.join(partial.streaming_content), full[10:])
+        partial.close()
+        
+        for headers, status in (
+            ({'Range': 'bytes=-5'}, 206),
+            ({'Range': f'bytes={len(full)}-'}, 416),
+            ({'Range': 'bytes=0-', 'If-Range': '"old"'}, 200),
+            ({'If-None-Match': etag}, 304),
+        ):
+            response = self.client.get(url, headers=headers)
+            response.close()
+            self.assertEqual(response.status_code, status)
+
+
+class ExternalPlayerIdTest(TestCase):
+    
+    def setUp(self):
+        player_resolver.invalidate()
+        level_catalog.invalidate()
+        self.level = Level.objects.create(title='Level 1', order=1)
+        LevelAward.objects.create(level=self.level, award=Award.objects.create(title='Gold'))
+        self.players = {name: PlayerTask2.objects.create(player_id=name).pk for name in ('ext-1', 'ext-2', 'ext-3')}
+    
+    def test_external_id_is_unique(self):
+        with self.assertRaises(IntegrityError):
+            PlayerTask2.objects.create(player_id='ext-1')
+    
+    def test_batch_resolution_and_lru(self):
+        resolver = PlayerIdResolver(max_size=2)
+        
+        with self.assertNumQueries(1):
+            resolved = resolver.resolve_many(['ext-1', 'ext-2', 'missing'])
+        self.assertEqual(resolved, {'ext-1': self.players['ext-1'], 'ext-2': self.players['ext-2']})
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve('ext-1'), self.players['ext-1'])
+        
+        #ext-2 самый старый и вытесняется
+        resolver.resolve('ext-3')
+        self.assertEqual(list(resolver.entries), ['ext-1', 'ext-3'])
+    
+    def test_delete_invalidates(self):
+        self.assertEqual(player_resolver.resolve('ext-3'), self.players['ext-3'])
+        PlayerTask2.objects.filter(player_id='ext-3').delete()
+        
+        self.assertIsNone(player_resolver.resolve('ext-3'))
+    
+    def test_entries_expire(self):
+        resolver = PlayerIdResolver(ttl=0)
+        resolver.resolve('ext-1')
+        
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.resolve('ext-1'), self.players['ext-1'])
+    
+    def test_stale_pk_is_resolved_again(self):
+        #другой процесс удалил и заново создал игрока, здесь в кэше остался старый pk
+        stale = self.players['ext-3']
+        PlayerTask2.objects.filter(pk=stale).delete()
+        fresh = PlayerTask2.objects.create(player_id='ext-3').pk
+        player_resolver._remember({'ext-3': stale})
+        
+        result = GameService.assign_award_by_external_id('ext-3', self.level.id)
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(player_resolver.resolve('ext-3'), fresh)
+        self.assertTrue(GameService.submit_score_by_external_id('ext-3', self.level.id, 5)['improved'])
+    
+    def test_service_entry_points(self):
+        result = GameService.assign_award_by_external_id('ext-1', self.level.id)
+        self.assertEqual(result['award'], ['Gold'])
+        self.assertFalse(GameService.assign_award_by_external_id('missing', self.level.id)['success'])
+        
+        self.assertTrue(GameService.submit_score_by_external_id('ext-2', self.level.id, 40)['improved'])
+        
+        batch = GameService.submit_scores_by_external_id([
+            ('ext-1', self.level.id, 10), ('ext-2', self.level.id, 30), ('missing', self.level.id, 99),
+        ])
+        self.assertEqual(batch['improved'], [('ext-1', self.level.id)])
+        self.assertEqual(batch['unknown'], ['missing'])
+        
+        maps = GameService.get_progression_maps_by_external_id(['ext-1', 'missing'])
+        self.assertEqual(list(maps), ['ext-1'])
+        self.assertEqual(maps['ext-1']['completed'], 1)
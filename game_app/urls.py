@@ -5,4 +5,6 @@ app_name = 'game_app'
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('players/<int:player_id>/state/', views.player_state, name='player_state'),
+    path('exports/player-levels.csv.gz', views.export_player_levels, name='export_player_levels'),
 ]
\ No newline at end of file
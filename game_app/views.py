@@ -1,6 +1,144 @@
+import os
+import re
+
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
+
+from .exports import current_fingerprint, export_snapshots, get_config as get_export_config, is_valid_token
+from .models import GameService, Player
+from .sharding import shard_for_pk
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
 
 
 def index(request):
-    return HttpResponse("Game Models Project - Тестовое задание")
\ No newline at end of file
+    return HttpResponse("Game Models Project - Тестовое задание")
+
+
+def is_internal_request(request):
+    #внутренние потребители снимков и выгрузки: staff-сессия или токен manage.py export_token
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = request.headers.get(get_export_config()['HEADER'])
+    return bool(token) and is_valid_token(token)
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match', '')
+    candidates = [value.strip().removeprefix('W/') for value in header.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+@require_GET
+def player_state(request, player_id):
+    if not is_internal_request(request):
+        return JsonResponse({'error': 'Нет доступа'}, status=403)
+    
+    #304 отдается по одной версии игрока, без чтения снимка
+    revision = Player.objects.using(shard_for_pk(player_id)).filter(
+        pk=player_id
+    ).values_list('revision', flat=True).first()
+    if revision is None:
+        return JsonResponse({'error': 'Игрок не найден'}, status=404)
+    
+    etag = f'"{player_id}-{revision}"'
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        snapshot = GameService.get_player_snapshot(player_id, revision)
+        etag = f'"{player_id}-{snapshot["revision"]}"'
+        response = JsonResponse(snapshot)
+    
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def parse_range(header, size):
+    #один диапазон bytes=a-b, bytes=a- или bytes=-n; None - отдать файл целиком, False - 416
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    
+    start, end = match.groups()
+    if start == '':
+        length = int(end)
+        if not length:
+            return False
+        start, end = max(size - length, 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class FileRange:
+    #диапазон открытого файла для StreamingHttpResponse: ответ закрывает файл, даже если тело не читали
+    
+    def __init__(self, snapshot, start, end, block_size=64 * 1024):
+        self.snapshot = snapshot
+        self.start = start
+        self.end = end
+        self.block_size = block_size
+    
+    def __iter__(self):
+        self.snapshot.seek(self.start)
+        remaining = self.end - self.start + 1
+        while remaining > 0:
+            block = self.snapshot.read(min(self.block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    
+    def close(self):
+        self.snapshot.close()
+
+
+@require_GET
+def export_player_levels(request):
+    #gzip-снимок выгрузки из кэша на диске, докачка через Range/If-Range
+    if not is_internal_request(request):
+        return JsonResponse({'error': 'Нет доступа'}, status=403)
+    
+    #304 по версии данных, без сборки снимка
+    fingerprint = current_fingerprint()
+    etag = f'"{fingerprint}"'
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+    
+    fingerprint, snapshot = export_snapshots.open_snapshot(fingerprint)
+    stat = os.fstat(snapshot.fileno())
+    byte_range = None
+    if 'Range' in request.headers:
+        #If-Range с другим ETag: снимок сменился, докачка невозможна
+        if request.headers.get('If-Range', etag) == etag:
+            byte_range = parse_range(request.headers['Range'], stat.st_size)
+    
+    if byte_range is False:
+        snapshot.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+    
+    if byte_range is None:
+        response = FileResponse(snapshot, content_type='application/gzip')
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(FileRange(snapshot, start, end), status=206, content_type='application/gzip')
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = end - start + 1
+    
+    response['Content-Disposition'] = 'attachment; filename="player_level_data.csv.gz"'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
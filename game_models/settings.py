@@ -2,6 +2,7 @@
 Django settings for game_models project.
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +41,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'game_app.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'game_models.urls'
@@ -73,6 +75,39 @@ DATABASES = {
     }
 }
 
+#шарды игроков: GAME_SHARD_COUNT=N поднимает N локальных файлов SQLite,
+#справочники и служебные таблицы остаются на default
+GAME_SHARDS = [f'shard{index}' for index in range(int(os.environ.get('GAME_SHARD_COUNT', '0')))]
+
+#алиасы шардов объявлены всегда, не меньше двух для ShardingTest: файл SQLite появляется только
+#при подключении, включает шарды только GAME_SHARDS; тестовый прогон выключает их в GameTestRunner
+for index in range(max(len(GAME_SHARDS), 2)):
+    DATABASES[f'shard{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_shard{index}.sqlite3',
+    }
+
+DATABASE_ROUTERS = ['game_app.routers.PlayerShardRouter'] if GAME_SHARDS else []
+
+TEST_RUNNER = 'game_app.test_runner.GameTestRunner'
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    #ответы для повторных запросов, LocMem вытесняет по LRU при переполнении
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'game-idempotency',
+        'TIMEOUT': 3600,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -113,4 +148,28 @@ STATIC_URL = 'static/'
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Game settings
+
+#ключи идемпотентности GameService: TTL в секундах и лимит строк в таблице
+GAME_IDEMPOTENCY = {
+    'CACHE_ALIAS': 'idempotency',
+    'TTL': 3600,
+    'MAX_DB_ENTRIES': 100000,
+}
+
+#профилирование по подписанному токену (manage.py profile_token) и флагу --profile у команд
+GAME_PROFILING = {
+    'OUTPUT_DIR': BASE_DIR / 'profiles',
+    'MAX_PER_MINUTE': 6,
+}
+
+#снимки csv-выгрузки (game_app/exports.py): пересборка при смене версии данных или по возрасту
+GAME_EXPORTS = {
+    'OUTPUT_DIR': BASE_DIR / 'exports',
+    'MAX_AGE': 3600,
+    'MAX_FILES': 5,
+    'MAX_BYTES': 512 * 1024 * 1024,
+}